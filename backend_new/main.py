@@ -1,8 +1,8 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Response, status
-from models.pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest, User, ChatNameUpdate, HighlightResponse, ChatRequest, DocumentHighlightsRequest, DocumentHighlightsResponse, ChatResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Header, Request, Response, status
+from models.pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest, User, ChatNameUpdate, HighlightResponse, ChatRequest, DocumentHighlightsRequest, DocumentHighlightsResponse, ChatResponse, IngestionJobStatus, IngestionBatchManifest
 from fastapi.security import OAuth2PasswordBearer
 from models.user import UserRegister
-from services.langchain_utils import get_rag_chain, get_source_chunks
+from services.langchain_utils import get_rag_chain, get_source_chunks, embed_question
 from services.database import (
       insert_application_logs,
       get_chat_history, get_all_documents, 
@@ -12,8 +12,8 @@ from services.database import (
       insert_user,
       get_user_chat_history,
       delete_chat_session,
+      get_document_chunks,
       reset_password_db,
-      store_pdf,
       get_pdf,
       get_db_connection,
       create_pdf_store,
@@ -29,27 +29,52 @@ from services.database import (
       store_chat_message,
       print_database_info,
       clear_all_data_except_users,
+      enqueue_ingestion_job,
+      get_ingestion_job,
+      get_latest_ingestion_job_id,
+      has_active_ingestion_job,
+    get_ingestion_job_events,
+    retry_ingestion_job,
+    create_ingestion_batch,
+    add_ingestion_batch_file,
+    get_ingestion_batch,
+      store_pdf_file,
+      replace_pdf_file,
+      find_user_pdf_by_hash,
 )
 from services.vector_store_db import (
     index_document_to_chroma, 
     delete_doc_from_chroma,
-    process_pdf,
-    clear_vectorstore
+    clear_vectorstore,
+    get_vectorstore
 )
+from services.workspace import ingestion_workspace
+from services.ocr_cache import get_ocr_cache_stats
+from services.embedding_cache import get_embedding_cache_stats
+from services.query_cache import get_query_cache_stats
+from services.answer_cache import answer_cache_applies, get_cached_answer, put_cached_answer, get_answer_cache_stats
+from services.ingestion import start_ingestion_workers, stop_ingestion_workers, get_ingestion_readiness
 from services.auth import decode_token, hash_password, create_access_token,verify_password, oauth2_scheme
 import os
 import uuid
 import logging
 import shutil
-from typing import Dict, List
+import hashlib
+import asyncio
+import time
+import zipfile
+from typing import Dict, List, Optional, Tuple
 from PIL import Image
 import pytesseract
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
 import sys
 from datetime import datetime
 import openai
 from pydantic import BaseModel
+from langchain_core.documents import Document
 
 import json
 
@@ -95,6 +120,14 @@ allowed_extensions = [
     '.html'
 ]
 
+# Uploads are streamed to disk in pieces of this size and rejected past the maximum
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "1024")) * 1024 * 1024
+
+# How often job event streams check for new events, and how long they may stay silent before a keep-alive
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", "0.5"))
+JOB_EVENTS_KEEPALIVE_SECONDS = 15
+
 # Initialize database tables
 @app.on_event("startup")
 async def startup_event():
@@ -107,6 +140,31 @@ async def startup_event():
         logging.error(f"Error initializing database: {str(e)}")
         raise
 
+    # Uploads are processed by background workers instead of inside the request.
+    # Each worker loads the OCR models as soon as it starts; /ready reports when they are hot.
+    start_ingestion_workers()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    stop_ingestion_workers()
+
+@app.get("/ready")
+async def readiness():
+    readiness_status = get_ingestion_readiness()
+    return JSONResponse(
+        content=readiness_status,
+        status_code=status.HTTP_200_OK if readiness_status["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    return {
+        "ocr": get_ocr_cache_stats(),
+        "embeddings": get_embedding_cache_stats(),
+        "queries": get_query_cache_stats(),
+        "answers": get_answer_cache_stats()
+    }
+
 @app.get("/chat-history")
 async def get_chat_history_endpoint(user_id: int):
     return get_user_chat_history(user_id)
@@ -146,6 +204,69 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+def store_source_highlights(session_id: str, source_docs: List[Document]) -> Dict[int, List[str]]:
+    """Store a highlight per source document of an answer, returning pdf_id -> highlight ids."""
+    # Layout chunks carry their page and bounding box in document_chunks; fetch them in one query
+    chunk_rows = get_document_chunks([doc.metadata['chunk_id'] for doc in source_docs if doc.metadata.get('chunk_id')])
+
+    documents = {}  # pdf_id -> list of highlight_ids
+    for doc in source_docs:
+        pdf_id = doc.metadata.get('file_id')
+        logging.info(f"Processing source document with PDF ID: {pdf_id}")
+        
+        if not pdf_id:
+            logging.warning("Source document missing file_id in metadata")
+            continue
+        
+        # Verify PDF exists before creating highlight
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM pdf_store WHERE id = ?', (pdf_id,))
+        if not cursor.fetchone():
+            logging.warning(f"PDF with ID {pdf_id} not found in database")
+            continue
+        
+        # Get the filename from the database
+        cursor.execute('SELECT filename FROM pdf_store WHERE id = ?', (pdf_id,))
+        pdf_data = cursor.fetchone()
+        filename = pdf_data['filename'] if pdf_data else 'unknown.pdf'
+        
+        if pdf_id not in documents:
+            documents[pdf_id] = []
+        
+        # Summary chunks have no row of their own and fall back to whatever position the metadata has
+        position = chunk_rows.get(doc.metadata.get('chunk_id')) or doc.metadata
+
+        # Create highlight with logging
+        highlight_data = {
+            "highlight_id": str(uuid.uuid4()),
+            "chat_id": session_id,
+            "pdf_id": pdf_id,
+            "chunk_id": doc.metadata.get('chunk_id'),
+            "content_text": doc.page_content.strip(),
+            "position": {
+                "boundingRect": {
+                    "x1": float(position.get('x1') or 0),
+                    "y1": float(position.get('y1') or 0),
+                    "x2": float(position.get('x2') or 0),
+                    "y2": float(position.get('y2') or 0),
+                    "width": float(position.get('width') or 0),
+                    "height": float(position.get('height') or 0)
+                },
+                "pageNumber": int(position.get('page_number') or 1)
+            },
+            "comment": {
+                "text": "Source text for the answer",
+                "emoji": "💡"
+            },
+            "filename": filename  # Use the retrieved filename
+        }
+        
+        logging.info(f"Creating highlight for PDF {pdf_id}: {highlight_data}")
+        highlight_id = store_highlight(highlight_data)
+        documents[pdf_id].append(highlight_id)
+    return documents
+
 # Update chat endpoint
 @app.post("/chat")
 async def chat(
@@ -176,92 +297,56 @@ async def chat(
             user_id=request.user_id
         )
         
-        # Initialize RAG chain
-        rag_chain = get_rag_chain(model_name=request.model)
-        
-        # Log the documents being processed
-        logging.info(f"Processing chat for session {request.session_id}")
-        
-        response = rag_chain.invoke({
-            "question": request.question,
-            "chat_history": chat_history
-        })
-        
-        # Extract source documents and log them
-        source_docs = response.get("source_documents", [])
+        use_answer_cache = answer_cache_applies(request.session_id)
+        cached = None
+        if use_answer_cache:
+            question_vector = embed_question(get_vectorstore(request.user_id), request.question)
+            chunk_ids = [doc.id for doc in get_source_chunks(request.question, request.user_id)]
+            cached = get_cached_answer(request.user_id, request.model, question_vector, chunk_ids)
+
+        if cached is not None:
+            answer = cached["answer"]
+            source_docs = [Document(**doc) for doc in cached["source_documents"]]
+        else:
+            # Initialize RAG chain
+            rag_chain = get_rag_chain(user_id=request.user_id, model_name=request.model)
+
+            # Log the documents being processed
+            logging.info(f"Processing chat for session {request.session_id}")
+
+            response = rag_chain.invoke({
+                "question": request.question,
+                "chat_history": chat_history
+            })
+            answer = response.get("answer", "")
+            source_docs = response.get("source_documents", [])
+            if use_answer_cache:
+                put_cached_answer(
+                    request.user_id, request.model, request.question, question_vector, chunk_ids, answer,
+                    [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in source_docs]
+                )
+
         logging.info(f"Retrieved {len(source_docs)} source documents")
-        
-        # Store highlights and collect document references
-        documents = {}  # pdf_id -> list of highlight_ids
-        for doc in source_docs:
-            pdf_id = doc.metadata.get('file_id')
-            logging.info(f"Processing source document with PDF ID: {pdf_id}")
-            
-            if not pdf_id:
-                logging.warning("Source document missing file_id in metadata")
-                continue
-            
-            # Verify PDF exists before creating highlight
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id FROM pdf_store WHERE id = ?', (pdf_id,))
-            if not cursor.fetchone():
-                logging.warning(f"PDF with ID {pdf_id} not found in database")
-                continue
-            
-            # Get the filename from the database
-            cursor.execute('SELECT filename FROM pdf_store WHERE id = ?', (pdf_id,))
-            pdf_data = cursor.fetchone()
-            filename = pdf_data['filename'] if pdf_data else 'unknown.pdf'
-            
-            if pdf_id not in documents:
-                documents[pdf_id] = []
-            
-            # Create highlight with logging
-            highlight_data = {
-                "highlight_id": str(uuid.uuid4()),
-                "chat_id": request.session_id,
-                "pdf_id": pdf_id,
-                "content_text": doc.page_content.strip(),
-                "position": {
-                    "boundingRect": {
-                        "x1": float(doc.metadata.get('x1', 0)),
-                        "y1": float(doc.metadata.get('y1', 0)),
-                        "x2": float(doc.metadata.get('x2', 0)),
-                        "y2": float(doc.metadata.get('y2', 0)),
-                        "width": float(doc.metadata.get('width', 0)),
-                        "height": float(doc.metadata.get('height', 0))
-                    },
-                    "pageNumber": int(doc.metadata.get('page_number', 1))
-                },
-                "comment": {
-                    "text": "Source text for the answer",
-                    "emoji": "💡"
-                },
-                "filename": filename  # Use the retrieved filename
-            }
-            
-            logging.info(f"Creating highlight for PDF {pdf_id}: {highlight_data}")
-            highlight_id = store_highlight(highlight_data)
-            documents[pdf_id].append(highlight_id)
-        
+        documents = store_source_highlights(request.session_id, source_docs)
+
         logging.info(f"Final documents and highlights mapping: {documents}")
         
         # Store the chat message
         store_chat_message(
             session_id=request.session_id,
             user_query=request.question,
-            gpt_response=response.get("answer", "")
+            gpt_response=answer
         )
         
         # Format the response according to new structure
         return ChatResponse(
-            answer=response.get("answer", ""),
+            answer=answer,
             session_id=request.session_id,
             model=request.model,
             name=chat_data.get("name"),
             user_id=request.user_id,
-            documents=documents
+            documents=documents,
+            cached=cached is not None
         )
         
     except Exception as e:
@@ -276,10 +361,100 @@ async def chat(
 def delete_chat_history(user_id:int,session_id:str):
     return delete_chat_session(user_id,session_id)
 
-@app.post("/upload-pdf")
+async def save_upload_to_file(file: UploadFile, dest_path: str) -> Tuple[int, str]:
+    """Stream an upload to dest_path chunk by chunk, returning its size and SHA-256."""
+    hasher = hashlib.sha256()
+    file_size = 0
+    with open(dest_path, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_UPLOAD_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"File exceeds the maximum upload size of {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"
+                )
+            hasher.update(chunk)
+            out.write(chunk)
+    return file_size, hasher.hexdigest()
+
+def extract_zip_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, dest_path: str) -> Tuple[int, str]:
+    """Copy one archive member to dest_path, returning its size and SHA-256.
+
+    The size limit is enforced on the bytes actually inflated, since the archive header can lie.
+    """
+    hasher = hashlib.sha256()
+    file_size = 0
+    with archive.open(info) as src, open(dest_path, "wb") as out:
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_UPLOAD_BYTES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"File exceeds the maximum upload size of {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"
+                )
+            hasher.update(chunk)
+            out.write(chunk)
+    return file_size, hasher.hexdigest()
+
+async def queue_pdf_file(upload_path: str, filename: str, user_id: int, file_size: int, content_hash: str,
+                         replace_pdf_id: Optional[int] = None) -> Dict:
+    """Store a PDF saved at upload_path and queue it for ingestion, unless the user already has the same bytes.
+
+    With replace_pdf_id the upload is a new version of that PDF, re-indexed in place so unchanged chunks are kept.
+    """
+    if file_size == 0:
+        logging.error("Empty file detected")
+        raise HTTPException(
+            status_code=400,
+            detail="Empty file detected"
+        )
+
+    # Identical bytes from the same user: nothing to store or ingest again
+    existing_pdf_id = find_user_pdf_by_hash(user_id, content_hash)
+    if existing_pdf_id:
+        logging.info(f"Duplicate upload of PDF {existing_pdf_id} for user {user_id}")
+        return {
+            "message": "Document already uploaded",
+            "pdf_id": existing_pdf_id,
+            "job_id": get_latest_ingestion_job_id(existing_pdf_id),
+            "status": "duplicate"
+        }
+
+    if replace_pdf_id is not None:
+        logging.info(f"Replacing PDF {replace_pdf_id} with a new version...")
+        # The running job would read the new file halfway through, and its checkpoints belong to the old one
+        if has_active_ingestion_job(replace_pdf_id):
+            raise HTTPException(
+                status_code=409,
+                detail=f"PDF {replace_pdf_id} is still being processed; retry once its ingestion job finishes"
+            )
+        if not await run_in_threadpool(replace_pdf_file, replace_pdf_id, user_id, filename, upload_path, content_hash, file_size):
+            raise HTTPException(
+                status_code=404,
+                detail=f"PDF {replace_pdf_id} not found or access denied"
+            )
+        pdf_id = replace_pdf_id
+    else:
+        # Store PDF in database, copying from the file off the event loop
+        logging.info("Storing PDF in database...")
+        pdf_id = await run_in_threadpool(store_pdf_file, filename, user_id, upload_path, content_hash, file_size)
+        logging.info(f"PDF stored successfully with ID: {pdf_id}")
+
+    # OCR, summarization and indexing run in the background ingestion workers
+    job_id = enqueue_ingestion_job(pdf_id, user_id, filename)
+
+    return {
+        "message": "Document uploaded and queued for processing",
+        "pdf_id": pdf_id,
+        "job_id": job_id,
+        "status": "queued"
+    }
+
+@app.post("/upload-pdf", status_code=status.HTTP_202_ACCEPTED)
 async def upload_document(
     file: UploadFile = File(...),
     user_id: int = Form(...),
+    replace_pdf_id: Optional[int] = Form(None),
     current_user: User = Depends(get_current_user)
 ):
     try:
@@ -298,55 +473,14 @@ async def upload_document(
             )
 
         try:
-            # Read file content as bytes
-            logging.info("Reading file content...")
-            file_content = await file.read()  # This returns bytes
-            file_size = len(file_content)
-            logging.info(f"File size: {file_size} bytes")
-
-            if file_size == 0:
-                logging.error("Empty file detected")
-                raise HTTPException(
-                    status_code=400,
-                    detail="Empty file detected"
-                )
-
-            # Create temporary file for processing
-            temp_file_path = f"temp_{uuid.uuid4()}.pdf"
-            try:
-                with open(temp_file_path, "wb") as temp_file:
-                    temp_file.write(file_content)
-
-                # Store PDF in database
-                logging.info("Storing PDF in database...")
-                pdf_id = store_pdf(file.filename, user_id, file_content)
-                logging.info(f"PDF stored successfully with ID: {pdf_id}")
-
-                
-                # Process the PDF and get chunks
-                chunks = process_pdf(temp_file_path)
-                with open("chunks.json", "w", encoding="utf-8") as f:
-                    json.dump(chunks, f, ensure_ascii=False, indent=2)
-
-                # Index in vector database
-                logging.info("Indexing PDF in vector database...")
-                file_path = "temp_final_summary.txt"
-                indexing_success = index_document_to_chroma(
-                    file_id=pdf_id,
-                    file_path=file_path,
-                    user_id=user_id
-                )
-
-                if not indexing_success:
-                    raise Exception("Failed to index document in vector store")
+            # Stream the upload to disk, hashing and size-checking as it arrives
+            with ingestion_workspace(prefix="upload-") as workspace_dir:
+                upload_path = os.path.join(workspace_dir, "upload.pdf")
+                logging.info("Streaming file content to disk...")
+                file_size, content_hash = await save_upload_to_file(file, upload_path)
+                logging.info(f"File size: {file_size} bytes")
 
-                return {"message": "Document uploaded successfully", "pdf_id": pdf_id}
-
-            finally:
-                # Clean up temp file
-                if os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
-                    logging.info(f"Cleaned up temporary file: {temp_file_path}")
+                return await queue_pdf_file(upload_path, file.filename, user_id, file_size, content_hash, replace_pdf_id)
 
         except HTTPException as he:
             raise he
@@ -366,6 +500,172 @@ async def upload_document(
             detail=f"Upload failed: {str(e)}"
         )
 
+@app.post("/upload-batch", response_model=IngestionBatchManifest, status_code=status.HTTP_202_ACCEPTED)
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Queue many PDFs at once, given directly or inside zip archives, and return the batch manifest.
+
+    A bad file is recorded as rejected in the manifest instead of failing the whole batch.
+    """
+    batch_id = create_ingestion_batch(current_user.id)
+    logging.info(f"Starting upload batch {batch_id} with {len(files)} files for user {current_user.id}")
+
+    async def add_pdf(upload_path: str, filename: str, file_size: int, content_hash: str):
+        try:
+            result = await queue_pdf_file(upload_path, filename, current_user.id, file_size, content_hash)
+            add_ingestion_batch_file(batch_id, filename, result["status"], result["pdf_id"], result["job_id"])
+        except HTTPException as he:
+            add_ingestion_batch_file(batch_id, filename, "rejected", error=str(he.detail))
+        except Exception as e:
+            logging.error(f"Error queueing {filename} in batch {batch_id}: {str(e)}")
+            add_ingestion_batch_file(batch_id, filename, "rejected", error=str(e))
+
+    for file in files:
+        filename = file.filename or "upload"
+        try:
+            # One workspace per upload, so a large batch never holds more than one file in scratch
+            with ingestion_workspace(prefix="batch-") as workspace_dir:
+                if filename.lower().endswith(".zip"):
+                    archive_path = os.path.join(workspace_dir, "upload.zip")
+                    await save_upload_to_file(file, archive_path)
+                    with zipfile.ZipFile(archive_path) as archive:
+                        for info in archive.infolist():
+                            member_name = os.path.basename(info.filename)
+                            if info.is_dir() or info.filename.startswith("__MACOSX/") or not member_name.lower().endswith(".pdf"):
+                                continue
+                            # Members are written under a fixed name, so paths inside the archive never reach the filesystem
+                            member_path = os.path.join(workspace_dir, "member.pdf")
+                            try:
+                                file_size, content_hash = await run_in_threadpool(extract_zip_member, archive, info, member_path)
+                            except HTTPException as he:
+                                add_ingestion_batch_file(batch_id, member_name, "rejected", error=str(he.detail))
+                                continue
+                            except Exception as e:
+                                # Encrypted or corrupt members, or a full disk: the rest of the archive can still go through
+                                logging.error(f"Error extracting {member_name} from {filename} in batch {batch_id}: {str(e)}")
+                                add_ingestion_batch_file(batch_id, member_name, "rejected", error=f"Could not extract file: {str(e)}")
+                                continue
+                            await add_pdf(member_path, member_name, file_size, content_hash)
+
+                elif filename.lower().endswith(".pdf"):
+                    upload_path = os.path.join(workspace_dir, "upload.pdf")
+                    file_size, content_hash = await save_upload_to_file(file, upload_path)
+                    await add_pdf(upload_path, filename, file_size, content_hash)
+
+                else:
+                    add_ingestion_batch_file(batch_id, filename, "rejected", error="Only PDF files and zip archives are allowed")
+
+        except HTTPException as he:
+            add_ingestion_batch_file(batch_id, filename, "rejected", error=str(he.detail))
+        except zipfile.BadZipFile:
+            add_ingestion_batch_file(batch_id, filename, "rejected", error="Not a valid zip archive")
+        except Exception as e:
+            # Files already accepted from this batch stay queued; only this one is rejected
+            logging.error(f"Error saving {filename} in batch {batch_id}: {str(e)}")
+            add_ingestion_batch_file(batch_id, filename, "rejected", error=f"Could not save file: {str(e)}")
+
+    manifest = get_ingestion_batch(batch_id)
+    logging.info(f"Upload batch {batch_id} done: {manifest['counts']}")
+    return IngestionBatchManifest(**manifest)
+
+@app.get("/batches/{batch_id}", response_model=IngestionBatchManifest)
+async def get_batch_status(
+    batch_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    manifest = get_ingestion_batch(batch_id)
+    if not manifest or manifest["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Batch {batch_id} not found"
+        )
+    return IngestionBatchManifest(**manifest)
+
+@app.get("/jobs/{job_id}", response_model=IngestionJobStatus)
+async def get_job_status(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    job = get_ingestion_job(job_id)
+    if not job or job["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found"
+        )
+    return IngestionJobStatus(**job)
+
+@app.post("/jobs/{job_id}/retry", response_model=IngestionJobStatus)
+async def retry_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Requeue a failed job. It resumes from the pages, summaries and embedding batches the failed attempt finished."""
+    job = get_ingestion_job(job_id)
+    if not job or job["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found"
+        )
+    if not retry_ingestion_job(job_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Job {job_id} is {job['status']}; only failed jobs can be retried"
+        )
+    return IngestionJobStatus(**get_ingestion_job(job_id))
+
+def format_sse(event: str, data: Dict, event_id: Optional[int] = None) -> str:
+    message = f"id: {event_id}\n" if event_id is not None else ""
+    return message + f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    """Server-sent events for one ingestion job: stage transitions and progress, then a final completed/failed event."""
+    job = get_ingestion_job(job_id)
+    if not job or job["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found"
+        )
+
+    # Reconnecting clients send Last-Event-ID and pick up where they left off
+    after_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+
+    async def event_stream():
+        nonlocal after_id
+        last_sent = time.monotonic()
+        while not await request.is_disconnected():
+            # Read the status before the events: a finished job has written all of its events already
+            current = await run_in_threadpool(get_ingestion_job, job_id)
+            events = await run_in_threadpool(get_ingestion_job_events, job_id, after_id)
+            for event in events:
+                after_id = event["id"]
+                yield format_sse(event["event"], event, event["id"])
+                last_sent = time.monotonic()
+
+            if current is None:
+                return
+            if current["status"] in ("completed", "failed"):
+                yield format_sse(current["status"], IngestionJobStatus(**current).dict())
+                return
+
+            if time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/list-docs", response_model=List[DocumentInfo])
 def list_documents(user_id:int):
     return get_all_documents(user_id)
@@ -118,6 +118,7 @@ class ChatResponse(BaseModel):
     name: Optional[str]
     user_id: int
     documents: Dict[int, List[str]]  # pdf_id -> list of highlight_ids
+    cached: bool = False  # answer reused from an earlier, near-identical question
 
 class DocumentHighlightsRequest(BaseModel):
     pdf_id: int
@@ -139,4 +140,32 @@ class HighlightResponse(BaseModel):
     filename: str
     highlights: List[Dict[str, Any]] = []
 
-
+class IngestionBatchFile(BaseModel):
+    filename: Optional[str] = None
+    status: str
+    pdf_id: Optional[int] = None
+    job_id: Optional[str] = None
+    stage: Optional[str] = None
+    progress: float = 0
+    error: Optional[str] = None
+
+class IngestionBatchManifest(BaseModel):
+    batch_id: str
+    created_at: Optional[datetime] = None
+    counts: Dict[str, int] = {}
+    files: List[IngestionBatchFile] = []
+
+class IngestionJobStatus(BaseModel):
+    job_id: str
+    pdf_id: int
+    filename: Optional[str] = None
+    status: str
+    stage: Optional[str] = None
+    progress: float = 0
+    stage_timings: Dict[str, float] = {}
+    error: Optional[str] = None
+    result: Dict[str, Any] = {}
+    attempts: int = 0
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
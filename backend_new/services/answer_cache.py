@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from services.database import get_db_connection, get_corpus_version, has_chat_messages
+
+# Off by default: a reused answer is only right if near-identical questions really deserve the same answer
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Largest cosine distance between two questions' embeddings for one's answer to serve the other
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.05"))
+# Cached answers kept per user; the oldest go first
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+
+
+def create_answer_cache():
+    conn = get_db_connection()
+    conn.execute('''CREATE TABLE IF NOT EXISTS answer_cache
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id INTEGER NOT NULL,
+                     corpus_version INTEGER NOT NULL,
+                     model TEXT NOT NULL,
+                     chunk_key TEXT NOT NULL,
+                     question TEXT,
+                     question_vector BLOB NOT NULL,
+                     answer TEXT NOT NULL,
+                     source_documents TEXT NOT NULL,
+                     hits INTEGER NOT NULL DEFAULT 0,
+                     created_at REAL NOT NULL)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_answer_cache_lookup ON answer_cache(user_id, corpus_version, model, chunk_key)')
+    conn.commit()
+    conn.close()
+
+
+def answer_cache_applies(session_id: str) -> bool:
+    """Only a chat's first question stands alone; later ones depend on the conversation before them."""
+    return ANSWER_CACHE_ENABLED and not has_chat_messages(session_id)
+
+
+def _chunk_key(chunk_ids: List[str]) -> str:
+    return json.dumps(sorted(chunk_ids))
+
+
+def get_cached_answer(user_id: int, model: str, question_vector: List[float], chunk_ids: List[str]) -> Optional[Dict]:
+    """Find an answer to a question close to this one that was answered from the same chunks with the same model.
+
+    Returns {"question", "answer", "source_documents"} or None. Answers from before the user's documents last
+    changed never match.
+    """
+    if not chunk_ids:
+        return None
+    try:
+        conn = get_db_connection()
+        rows = conn.execute('''
+            SELECT id, question, question_vector, answer, source_documents
+            FROM answer_cache
+            WHERE user_id = ? AND corpus_version = ? AND model = ? AND chunk_key = ?
+        ''', (user_id, get_corpus_version(user_id), model, _chunk_key(chunk_ids))).fetchall()
+        if not rows:
+            conn.close()
+            return None
+
+        query = np.asarray(question_vector, dtype=np.float32)
+        cached = np.stack([np.frombuffer(row['question_vector'], dtype=np.float32) for row in rows])
+        similarity = cached @ query / (np.linalg.norm(cached, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = int(np.argmax(similarity))
+        if 1 - similarity[best] > ANSWER_CACHE_MAX_DISTANCE:
+            conn.close()
+            return None
+
+        row = rows[best]
+        conn.execute('UPDATE answer_cache SET hits = hits + 1 WHERE id = ?', (row['id'],))
+        conn.commit()
+        conn.close()
+        logging.info(f"Answer cache hit for user {user_id}: distance {1 - similarity[best]:.4f} to \"{row['question']}\"")
+        return {
+            "question": row['question'],
+            "answer": row['answer'],
+            "source_documents": json.loads(row['source_documents']),
+        }
+
+    except Exception as e:
+        # A broken cache only means the question is answered again
+        logging.error(f"Error reading answer cache: {str(e)}")
+        return None
+
+
+def put_cached_answer(user_id: int, model: str, question: str, question_vector: List[float], chunk_ids: List[str],
+                      answer: str, source_documents: List[Dict]):
+    """Cache an answer and the source documents it cites ({"page_content", "metadata"} each)."""
+    if not chunk_ids or not answer:
+        return
+    try:
+        version = get_corpus_version(user_id)
+        conn = get_db_connection()
+        # Answers from an older version of the user's documents can never be served again
+        conn.execute('DELETE FROM answer_cache WHERE user_id = ? AND corpus_version != ?', (user_id, version))
+        conn.execute('''
+            INSERT INTO answer_cache (user_id, corpus_version, model, chunk_key, question, question_vector,
+                                      answer, source_documents, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            user_id, version, model, _chunk_key(chunk_ids), question,
+            np.asarray(question_vector, dtype=np.float32).tobytes(),
+            answer, json.dumps(source_documents), time.time()
+        ))
+        conn.execute('''
+            DELETE FROM answer_cache
+            WHERE user_id = ? AND id NOT IN (
+                SELECT id FROM answer_cache WHERE user_id = ? ORDER BY id DESC LIMIT ?
+            )
+        ''', (user_id, user_id, ANSWER_CACHE_MAX_ENTRIES))
+        conn.commit()
+        conn.close()
+
+    except Exception as e:
+        logging.error(f"Error writing answer cache: {str(e)}")
+
+
+def get_answer_cache_stats() -> Dict:
+    conn = get_db_connection()
+    entries, hits = conn.execute('SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM answer_cache').fetchone()
+    conn.close()
+    return {
+        "enabled": ANSWER_CACHE_ENABLED,
+        "entries": entries,
+        "hits": hits,
+        "max_distance": ANSWER_CACHE_MAX_DISTANCE,
+    }
+
+
+# Initialize the cache table
+create_answer_cache()
@@ -0,0 +1,73 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Any, Iterable, Optional
+
+# Finished units of work per document, kept until the document is indexed so a retry resumes instead of restarting.
+# Section summaries outlive that, so re-indexing a revised document only re-summarizes the sections that changed.
+CHECKPOINT_DIR = os.getenv("INGEST_CHECKPOINT_DIR", "checkpoints")
+
+
+def content_key(text: str) -> str:
+    """Key a unit by its input, so a checkpoint is never reused for different content."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DocumentCheckpoint:
+    """Checkpoints for one document under CHECKPOINT_DIR/<pdf_id>/<kind>/<key>.json."""
+
+    def __init__(self, pdf_id: int):
+        self.pdf_id = pdf_id
+        self.root = os.path.join(CHECKPOINT_DIR, str(pdf_id))
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.root, kind, f"{key}.json")
+
+    def load(self, kind: str, key: str) -> Optional[Any]:
+        path = self._path(kind, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            # A damaged checkpoint only costs redoing that unit
+            logging.warning(f"Ignoring unreadable checkpoint {path}: {str(e)}")
+            return None
+
+    def save(self, kind: str, key: str, value: Any):
+        directory = os.path.join(self.root, kind)
+        os.makedirs(directory, exist_ok=True)
+        # Write then rename, so a crash mid-write never leaves a truncated checkpoint behind
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._path(kind, key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def prune(self, kind: str, keep_keys: Iterable[str]):
+        """Drop every checkpoint of kind whose key isn't in keep_keys."""
+        directory = os.path.join(self.root, kind)
+        if not os.path.isdir(directory):
+            return
+        keep = {f"{key}.json" for key in keep_keys}
+        for name in os.listdir(directory):
+            if name not in keep:
+                os.remove(os.path.join(directory, name))
+
+    def clear(self, keep_kinds: Iterable[str] = ()):
+        if not keep_kinds:
+            shutil.rmtree(self.root, ignore_errors=True)
+            return
+        if not os.path.isdir(self.root):
+            return
+        for kind in os.listdir(self.root):
+            if kind not in keep_kinds:
+                shutil.rmtree(os.path.join(self.root, kind), ignore_errors=True)
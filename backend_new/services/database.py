@@ -3,14 +3,22 @@ import sqlite3
 from datetime import datetime
 import logging
 import json
+import hashlib
+import re
 from typing import List, Dict, Optional, Any
 import os
-import shutil
+import uuid
+
+from services.checkpoints import DocumentCheckpoint
 
 DB_NAME = "rag_app.db"
 
+# Size of each read/write when copying PDFs between files and BLOBs
+BLOB_CHUNK_SIZE = 1024 * 1024
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+    # Ingestion workers write from separate processes, so wait on locks instead of failing fast
+    conn = sqlite3.connect(DB_NAME, timeout=30)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -66,6 +74,12 @@ def create_application_logs():
     conn.execute('CREATE INDEX IF NOT EXISTS idx_highlights_pdf_id ON highlights(pdf_id)')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_highlights_chat_id ON highlights(chat_id)')
     conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages(session_id)')
+
+    # Highlights point at the layout chunk they were built from
+    _add_missing_columns(conn, 'highlights', {
+        'chunk_id': 'INTEGER',
+    })
+    conn.commit()
     conn.close()
 
 def create_document_store():
@@ -90,7 +104,214 @@ def create_document_store():
                      y2 FLOAT,
                      width FLOAT,
                      height FLOAT,
+                     token_count INTEGER,
+                     content_hash TEXT,
                      FOREIGN KEY (doc_id) REFERENCES document_store (id) ON DELETE CASCADE)''')
+    _add_missing_columns(conn, 'document_chunks', {
+        'token_count': 'INTEGER',
+        'content_hash': 'TEXT',
+    })
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_document_chunks_doc_id ON document_chunks(doc_id)')
+    conn.close()
+
+def store_document_chunks(doc_id: int, chunks: List[Dict]) -> List[int]:
+    """Sync a document's layout chunks to chunks and return their ids in the same order.
+
+    Rows are matched by content hash: unchanged chunks keep their id (and the highlights pointing at it),
+    only new chunks are inserted and only chunks that disappeared are deleted, in one transaction.
+    """
+    hashes = chunk_content_hashes([c['chunk_text'] for c in chunks])
+    conn = get_db_connection()
+    try:
+        existing = {
+            row['content_hash']: row['id']
+            for row in conn.execute('SELECT id, content_hash FROM document_chunks WHERE doc_id = ?', (doc_id,))
+        }
+        ids = []
+        kept = 0
+        for c, content_hash in zip(chunks, hashes):
+            position = (c['page_number'], c['x1'], c['y1'], c['x2'], c['y2'], c['width'], c['height'], c['token_count'])
+            chunk_id = existing.pop(content_hash, None)
+            if chunk_id is not None:
+                # Same text, though it may have moved on the page
+                conn.execute('''
+                    UPDATE document_chunks
+                    SET page_number = ?, x1 = ?, y1 = ?, x2 = ?, y2 = ?, width = ?, height = ?, token_count = ?
+                    WHERE id = ?
+                ''', position + (chunk_id,))
+                kept += 1
+            else:
+                chunk_id = conn.execute('''
+                    INSERT INTO document_chunks (doc_id, chunk_text, content_hash, page_number, x1, y1, x2, y2, width, height, token_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (doc_id, c['chunk_text'], content_hash) + position).lastrowid
+            ids.append(chunk_id)
+
+        # What's left is gone from the document, as are rows stored before chunks were hashed
+        conn.executemany('DELETE FROM document_chunks WHERE id = ?', [(chunk_id,) for chunk_id in existing.values()])
+        conn.commit()
+        logging.info(f"Synced chunks of document {doc_id}: {kept} kept, {len(ids) - kept} added, {len(existing)} removed")
+        return ids
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error storing chunks for document {doc_id}: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+def copy_document_chunks(source_doc_id: int, doc_id: int) -> Dict[int, int]:
+    """Copy another document's layout chunks to doc_id, returning a map of old to new chunk ids."""
+    conn = get_db_connection()
+    rows = conn.execute('SELECT * FROM document_chunks WHERE doc_id = ? ORDER BY id', (source_doc_id,)).fetchall()
+    conn.close()
+    new_ids = store_document_chunks(doc_id, [dict(row) for row in rows])
+    return {row['id']: new_id for row, new_id in zip(rows, new_ids)}
+
+def get_document_chunks(chunk_ids: List[int]) -> Dict[int, Dict]:
+    """Look up layout chunks by id."""
+    if not chunk_ids:
+        return {}
+    conn = get_db_connection()
+    placeholders = ','.join('?' for _ in chunk_ids)
+    rows = conn.execute(f'SELECT * FROM document_chunks WHERE id IN ({placeholders})', list(chunk_ids)).fetchall()
+    conn.close()
+    return {row['id']: dict(row) for row in rows}
+
+def create_chunk_search():
+    conn = get_db_connection()
+    # Text of every indexed vector, keyed by its Chroma id, for lexical search next to the vector search
+    conn.execute('''CREATE TABLE IF NOT EXISTS chunk_search
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     vector_id TEXT UNIQUE NOT NULL,
+                     file_id INTEGER,
+                     user_id INTEGER,
+                     text TEXT NOT NULL,
+                     metadata TEXT)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chunk_search_file ON chunk_search(file_id, user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chunk_search_user ON chunk_search(user_id)')
+
+    # Trigrams match inside words, so part numbers and parts of German compounds are found too.
+    # SQLite before 3.34 has no trigram tokenizer and falls back to whole words.
+    for tokenizer in ('trigram', 'unicode61 remove_diacritics 2'):
+        try:
+            conn.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS chunk_search_fts
+                             USING fts5(text, content='chunk_search', content_rowid='id', tokenize='{tokenizer}')''')
+            break
+        except sqlite3.OperationalError as e:
+            logging.warning(f"FTS5 tokenizer {tokenizer} unavailable: {str(e)}")
+
+    # Keep the external-content index in step with chunk_search
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS chunk_search_ai AFTER INSERT ON chunk_search BEGIN
+                        INSERT INTO chunk_search_fts (rowid, text) VALUES (new.id, new.text);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS chunk_search_ad AFTER DELETE ON chunk_search BEGIN
+                        INSERT INTO chunk_search_fts (chunk_search_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS chunk_search_au AFTER UPDATE OF text ON chunk_search BEGIN
+                        INSERT INTO chunk_search_fts (chunk_search_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                        INSERT INTO chunk_search_fts (rowid, text) VALUES (new.id, new.text);
+                    END''')
+    conn.commit()
+    conn.close()
+
+def sync_chunk_search(file_id: int, user_id: int, vector_ids: List[str], texts: List[str], metadatas: List[Dict]):
+    """Make the lexical index hold exactly these vectors for file_id, mirroring the vector store."""
+    conn = get_db_connection()
+    try:
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS current_vectors (vector_id TEXT PRIMARY KEY)')
+        conn.execute('DELETE FROM current_vectors')
+        conn.executemany('INSERT OR IGNORE INTO current_vectors (vector_id) VALUES (?)', [(v,) for v in vector_ids])
+        conn.execute('''
+            DELETE FROM chunk_search
+            WHERE file_id = ? AND user_id = ? AND vector_id NOT IN (SELECT vector_id FROM current_vectors)
+        ''', (file_id, user_id))
+        # Unchanged text only has its metadata refreshed, which leaves the FTS index alone
+        conn.executemany('''
+            INSERT INTO chunk_search (vector_id, file_id, user_id, text, metadata)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(vector_id) DO UPDATE SET metadata = excluded.metadata
+        ''', [
+            (vector_id, file_id, user_id, text, json.dumps(metadata))
+            for vector_id, text, metadata in zip(vector_ids, texts, metadatas)
+        ])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error syncing lexical index for document {file_id}: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+def delete_chunk_search(file_id: int, user_id: int):
+    conn = get_db_connection()
+    conn.execute('DELETE FROM chunk_search WHERE file_id = ? AND user_id = ?', (file_id, user_id))
+    conn.commit()
+    conn.close()
+
+def has_chunk_search(user_id: int) -> bool:
+    conn = get_db_connection()
+    row = conn.execute('SELECT 1 FROM chunk_search WHERE user_id = ? LIMIT 1', (user_id,)).fetchone()
+    conn.close()
+    return row is not None
+
+def _fts_query(query: str) -> Optional[str]:
+    # Each term is quoted, so punctuation in part numbers and error codes is matched literally instead of parsed
+    terms = []
+    for term in re.findall(r'[\w][\w\-./:]*', query):
+        if len(term) >= 3 and term.lower() not in terms:
+            terms.append(term.lower())
+    if not terms:
+        return None
+    return ' OR '.join('"' + term.replace('"', '""') + '"' for term in terms[:32])
+
+def search_chunks(user_id: int, query: str, limit: int) -> List[Dict]:
+    """BM25-ranked lexical search over the user's chunks, best first, as {"vector_id", "text", "metadata"}."""
+    match = _fts_query(query)
+    if match is None:
+        return []
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('''
+            SELECT s.vector_id, s.text, s.metadata
+            FROM chunk_search_fts
+            JOIN chunk_search s ON s.id = chunk_search_fts.rowid
+            WHERE chunk_search_fts MATCH ? AND s.user_id = ?
+            ORDER BY bm25(chunk_search_fts)
+            LIMIT ?
+        ''', (match, user_id, limit)).fetchall()
+        return [
+            {"vector_id": row['vector_id'], "text": row['text'], "metadata": json.loads(row['metadata'] or '{}')}
+            for row in rows
+        ]
+    finally:
+        conn.close()
+
+def create_corpus_versions():
+    conn = get_db_connection()
+    # Bumped whenever a user's indexed documents change, so query results cached by any process go stale with them
+    conn.execute('''CREATE TABLE IF NOT EXISTS corpus_versions
+                    (user_id INTEGER PRIMARY KEY,
+                     version INTEGER NOT NULL DEFAULT 0)''')
+    conn.commit()
+    conn.close()
+
+def get_corpus_version(user_id: int) -> int:
+    conn = get_db_connection()
+    row = conn.execute('SELECT version FROM corpus_versions WHERE user_id = ?', (user_id,)).fetchone()
+    conn.close()
+    return row['version'] if row else 0
+
+def bump_corpus_version(user_id: Optional[int] = None):
+    """Mark user_id's documents as changed, or every user's when user_id is None."""
+    conn = get_db_connection()
+    if user_id is None:
+        conn.execute('UPDATE corpus_versions SET version = version + 1')
+    else:
+        conn.execute('''
+            INSERT INTO corpus_versions (user_id, version) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+        ''', (user_id,))
+    conn.commit()
     conn.close()
 
 def create_users_table():
@@ -302,6 +523,14 @@ def reset_password_db(email: str, hashed_password: str):
     conn.close()
     return {"message": "Password reset successfully!"}
 
+def _add_missing_columns(conn, table: str, columns: Dict[str, str]):
+    """Add columns to an existing table created by an older version of the schema."""
+    existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+    for name, definition in columns.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+            logging.info(f"Added column {name} to {table}")
+
 def create_pdf_store():
     try:
         conn = get_db_connection()
@@ -313,7 +542,26 @@ def create_pdf_store():
                          file_data BLOB NOT NULL,
                          user_id INTEGER,
                          upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                         content_hash TEXT,
+                         indexed INTEGER DEFAULT 0,
+                         version INTEGER DEFAULT 0,
                          FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE)''')
+
+        # Databases created before content hashing keep their rows; the new columns start empty
+        _add_missing_columns(conn, 'pdf_store', {
+            'content_hash': 'TEXT',
+            'indexed': 'INTEGER DEFAULT 0',
+            'version': 'INTEGER DEFAULT 0',
+        })
+
+        # Identical uploads share one blob, keyed by the SHA-256 of the file
+        cursor.execute('''CREATE TABLE IF NOT EXISTS pdf_blobs
+                        (content_hash TEXT PRIMARY KEY,
+                         file_data BLOB NOT NULL,
+                         file_size INTEGER,
+                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pdf_store_content_hash ON pdf_store(content_hash)')
         
         conn.commit()
         conn.close()
@@ -323,30 +571,52 @@ def create_pdf_store():
         logging.error(f"Error creating PDF store table: {str(e)}")
         raise
 
-def store_pdf(filename: str, user_id: int, file_content: bytes) -> int:
-    """Store PDF file in database."""
+def chunk_content_hashes(texts: List[str]) -> List[str]:
+    """Identify chunks by their text; repeats of the same text are numbered so each hash stays unique."""
+    seen = {}
+    hashes = []
+    for text in texts:
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        count = seen.get(digest, 0)
+        seen[digest] = count + 1
+        hashes.append(digest if count == 0 else f"{digest}-{count}")
+    return hashes
+
+def _write_pdf_blob(conn, file_path: str, content_hash: str, file_size: int):
+    # Reserve a zero-filled blob of the right size, then stream the file into it
+    cursor = conn.execute('''
+        INSERT OR IGNORE INTO pdf_blobs (content_hash, file_data, file_size)
+        VALUES (?, zeroblob(?), ?)
+    ''', (content_hash, file_size, file_size))
+    if cursor.rowcount:
+        with conn.blobopen('pdf_blobs', 'file_data', cursor.lastrowid) as blob, open(file_path, 'rb') as f:
+            while chunk := f.read(BLOB_CHUNK_SIZE):
+                blob.write(chunk)
+    else:
+        logging.info(f"Reusing stored blob for content hash {content_hash}")
+
+def store_pdf_file(filename: str, user_id: int, file_path: str, content_hash: str, file_size: int) -> int:
+    """Store a PDF from a file on disk, copying it into its BLOB in chunks rather than via one buffer."""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        
+
         logging.info(f"Storing PDF for user_id: {user_id}")
-        
-        # Make sure file_content is bytes
-        if isinstance(file_content, str):
-            file_content = file_content.encode('utf-8')
-        
+
+        _write_pdf_blob(conn, file_path, content_hash, file_size)
+
         cursor.execute('''
-            INSERT INTO pdf_store (filename, user_id, file_data) 
-            VALUES (?, ?, ?)
-        ''', (filename, user_id, file_content))
-        
+            INSERT INTO pdf_store (filename, user_id, file_data, content_hash) 
+            VALUES (?, ?, ?, ?)
+        ''', (filename, user_id, b'', content_hash))
+
         pdf_id = cursor.lastrowid
         conn.commit()
         conn.close()
-        
+
         logging.info(f"PDF {filename} stored successfully with ID: {pdf_id} for user_id: {user_id}")
         return pdf_id
-        
+
     except Exception as e:
         logging.error(f"Error storing PDF: {str(e)}")
         raise HTTPException(
@@ -354,6 +624,59 @@ def store_pdf(filename: str, user_id: int, file_content: bytes) -> int:
             detail=f"Failed to store PDF: {str(e)}"
         )
 
+def replace_pdf_file(pdf_id: int, user_id: int, filename: str, file_path: str, content_hash: str, file_size: int) -> bool:
+    """Swap in a revised file for one of the user's PDFs, keeping its id, chunks and highlights for re-indexing.
+
+    Returns False if pdf_id isn't the user's.
+    """
+    try:
+        conn = get_db_connection()
+        try:
+            row = conn.execute(
+                'SELECT content_hash FROM pdf_store WHERE id = ? AND user_id = ?',
+                (pdf_id, user_id)
+            ).fetchone()
+            if not row:
+                return False
+
+            _write_pdf_blob(conn, file_path, content_hash, file_size)
+
+            # Still answers from the previous version until the re-index bumps it
+            conn.execute('''
+                UPDATE pdf_store
+                SET filename = ?, content_hash = ?, file_data = ?, indexed = 0, upload_timestamp = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (filename, content_hash, b'', pdf_id))
+
+            # Drop the previous blob once nothing refers to it
+            if row['content_hash'] and row['content_hash'] != content_hash:
+                conn.execute('''
+                    DELETE FROM pdf_blobs
+                    WHERE content_hash = ?
+                    AND NOT EXISTS (SELECT 1 FROM pdf_store WHERE content_hash = ?)
+                ''', (row['content_hash'], row['content_hash']))
+
+            conn.commit()
+            # Pages OCR'd from the previous file mustn't resume into the new one; summaries are
+            # keyed by their text and are meant to carry over
+            DocumentCheckpoint(pdf_id).clear(keep_kinds=("summaries",))
+            logging.info(f"Replaced file of PDF {pdf_id} with {filename}")
+            return True
+
+        except Exception:
+            conn.rollback()
+            raise
+
+        finally:
+            conn.close()
+
+    except Exception as e:
+        logging.error(f"Error replacing PDF {pdf_id}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to replace PDF: {str(e)}"
+        )
+
 def get_all_user_pdfs(user_id: int) -> List[Dict]:
     """Get all PDFs for a user."""
     try:
@@ -408,11 +731,13 @@ def get_pdf(pdf_id: int, user_id: int) -> tuple[bytes, str]:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # First check if the PDF exists and belongs to the user
+        # First check if the PDF exists and belongs to the user.
+        # Rows stored before content hashing still carry their bytes inline.
         cursor.execute('''
-            SELECT filename, file_data 
-            FROM pdf_store 
-            WHERE id = ? AND user_id = ?
+            SELECT p.filename, COALESCE(b.file_data, p.file_data) AS file_data
+            FROM pdf_store p
+            LEFT JOIN pdf_blobs b ON b.content_hash = p.content_hash
+            WHERE p.id = ? AND p.user_id = ?
         ''', (pdf_id, user_id))
         
         result = cursor.fetchone()
@@ -426,6 +751,29 @@ def get_pdf(pdf_id: int, user_id: int) -> tuple[bytes, str]:
         logging.error(f"Error retrieving PDF {pdf_id}: {str(e)}")
         raise
 
+def copy_pdf_to_file(pdf_id: int, user_id: int, dest_path: str) -> Optional[str]:
+    """Stream a stored PDF into dest_path and return its filename, or None if it isn't the user's."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute('''
+            SELECT p.id, p.filename, b.rowid AS blob_rowid
+            FROM pdf_store p
+            LEFT JOIN pdf_blobs b ON b.content_hash = p.content_hash
+            WHERE p.id = ? AND p.user_id = ?
+        ''', (pdf_id, user_id)).fetchone()
+        if not row:
+            return None
+
+        # Rows stored before content hashing still carry their bytes inline
+        table, rowid = ('pdf_blobs', row['blob_rowid']) if row['blob_rowid'] else ('pdf_store', row['id'])
+        with conn.blobopen(table, 'file_data', rowid, readonly=True) as blob, open(dest_path, 'wb') as f:
+            while chunk := blob.read(BLOB_CHUNK_SIZE):
+                f.write(chunk)
+        return row['filename']
+
+    finally:
+        conn.close()
+
 def delete_pdf(pdf_id: int, user_id: int) -> bool:
     """Delete PDF and all associated data (chunks, highlights) from the database."""
     try:
@@ -438,10 +786,11 @@ def delete_pdf(pdf_id: int, user_id: int) -> bool:
         try:
             # First verify the PDF exists and belongs to the user
             cursor.execute(
-                'SELECT id FROM pdf_store WHERE id = ? AND user_id = ?',
+                'SELECT id, content_hash FROM pdf_store WHERE id = ? AND user_id = ?',
                 (pdf_id, user_id)
             )
-            if not cursor.fetchone():
+            pdf_row = cursor.fetchone()
+            if not pdf_row:
                 raise HTTPException(
                     status_code=404,
                     detail=f"PDF {pdf_id} not found or access denied"
@@ -462,9 +811,20 @@ def delete_pdf(pdf_id: int, user_id: int) -> bool:
                 'DELETE FROM pdf_store WHERE id = ? AND user_id = ?',
                 (pdf_id, user_id)
             )
+
+            # Drop the shared blob once its last owner is gone
+            if pdf_row['content_hash']:
+                cursor.execute('''
+                    DELETE FROM pdf_blobs
+                    WHERE content_hash = ?
+                    AND NOT EXISTS (SELECT 1 FROM pdf_store WHERE content_hash = ?)
+                ''', (pdf_row['content_hash'], pdf_row['content_hash']))
             
             # Commit transaction
             conn.commit()
+
+            # Leftovers of a failed ingestion would otherwise stay on disk forever
+            DocumentCheckpoint(pdf_id).clear()
             logging.info(f"Successfully deleted PDF {pdf_id} and all associated data")
             return True
             
@@ -500,10 +860,377 @@ def get_user_by_id(user_id: int):
         }
     return None
 
+def find_user_pdf_by_hash(user_id: int, content_hash: str) -> Optional[int]:
+    """Return the id of a PDF this user already uploaded with identical bytes."""
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT id FROM pdf_store
+        WHERE user_id = ? AND content_hash = ?
+        ORDER BY id
+        LIMIT 1
+    ''', (user_id, content_hash)).fetchone()
+    conn.close()
+    return row['id'] if row else None
+
+def find_indexed_pdf_by_hash(pdf_id: int) -> Optional[Dict]:
+    """Find another, fully indexed PDF with the same content as pdf_id."""
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT other.id, other.user_id
+        FROM pdf_store p
+        JOIN pdf_store other ON other.content_hash = p.content_hash AND other.id != p.id
+        WHERE p.id = ? AND p.content_hash IS NOT NULL AND other.indexed = 1
+        ORDER BY other.id
+        LIMIT 1
+    ''', (pdf_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def get_pdf_version(pdf_id: int) -> int:
+    """Return the version pdf_id was last indexed at (0 if never)."""
+    conn = get_db_connection()
+    row = conn.execute('SELECT version FROM pdf_store WHERE id = ?', (pdf_id,)).fetchone()
+    conn.close()
+    return (row['version'] or 0) if row else 0
+
+def mark_pdf_indexed(pdf_id: int, version: Optional[int] = None):
+    """Mark pdf_id as indexed, bumping it to version in the same update when one is given."""
+    conn = get_db_connection()
+    if version is None:
+        conn.execute('UPDATE pdf_store SET indexed = 1 WHERE id = ?', (pdf_id,))
+    else:
+        conn.execute('UPDATE pdf_store SET indexed = 1, version = ? WHERE id = ?', (version, pdf_id))
+    conn.commit()
+    conn.close()
+
+def create_ingestion_jobs():
+    conn = get_db_connection()
+
+    # WAL lets the API keep reading job status while ingestion workers write to it
+    conn.execute('PRAGMA journal_mode=WAL')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS ingestion_jobs
+                    (job_id TEXT PRIMARY KEY,
+                     pdf_id INTEGER,
+                     user_id INTEGER,
+                     filename TEXT,
+                     status TEXT NOT NULL DEFAULT 'queued',
+                     stage TEXT,
+                     progress REAL DEFAULT 0,
+                     stage_timings TEXT DEFAULT '{}',
+                     error TEXT,
+                     result TEXT DEFAULT '{}',
+                     attempts INTEGER DEFAULT 0,
+                     worker_pid INTEGER,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     started_at TIMESTAMP,
+                     finished_at TIMESTAMP,
+                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     FOREIGN KEY (pdf_id) REFERENCES pdf_store (id) ON DELETE CASCADE,
+                     FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE)''')
+
+    _add_missing_columns(conn, 'ingestion_jobs', {
+        'result': "TEXT DEFAULT '{}'",
+    })
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs(status, created_at)')
+
+    # Append-only log of stage transitions and progress, replayed to /jobs/{job_id}/events subscribers
+    conn.execute('''CREATE TABLE IF NOT EXISTS ingestion_job_events
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     job_id TEXT NOT NULL,
+                     attempt INTEGER DEFAULT 0,
+                     event TEXT NOT NULL,
+                     stage TEXT,
+                     completed INTEGER,
+                     total INTEGER,
+                     progress REAL,
+                     stage_elapsed REAL,
+                     elapsed REAL,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     FOREIGN KEY (job_id) REFERENCES ingestion_jobs (job_id) ON DELETE CASCADE)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingestion_job_events_job ON ingestion_job_events(job_id, id)')
+    conn.commit()
+    conn.close()
+
+def _job_row_to_dict(row) -> Dict:
+    job = dict(row)
+    job['stage_timings'] = json.loads(job['stage_timings'] or '{}')
+    job['result'] = json.loads(job['result'] or '{}')
+    return job
+
+def enqueue_ingestion_job(pdf_id: int, user_id: int, filename: str) -> str:
+    """Queue a PDF for background ingestion and return the job id."""
+    try:
+        job_id = str(uuid.uuid4())
+        conn = get_db_connection()
+        conn.execute('''
+            INSERT INTO ingestion_jobs (job_id, pdf_id, user_id, filename, stage)
+            VALUES (?, ?, ?, ?, 'queued')
+        ''', (job_id, pdf_id, user_id, filename))
+        conn.commit()
+        conn.close()
+
+        logging.info(f"Queued ingestion job {job_id} for PDF {pdf_id}")
+        return job_id
+
+    except Exception as e:
+        logging.error(f"Error queueing ingestion job: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to queue ingestion job: {str(e)}"
+        )
+
+def claim_next_ingestion_job(worker_pid: int) -> Optional[Dict]:
+    """Atomically move the oldest queued job to running and return it."""
+    conn = get_db_connection()
+    try:
+        # IMMEDIATE takes the write lock up front so two workers never claim the same job
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('''
+            SELECT * FROM ingestion_jobs
+            WHERE status = 'queued'
+            ORDER BY created_at, rowid
+            LIMIT 1
+        ''').fetchone()
+
+        if not row:
+            conn.commit()
+            return None
+
+        conn.execute('''
+            UPDATE ingestion_jobs
+            SET status = 'running', attempts = attempts + 1, worker_pid = ?,
+                started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+        ''', (worker_pid, row['job_id']))
+        conn.commit()
+
+        job = _job_row_to_dict(row)
+        job['status'] = 'running'
+        job['attempts'] += 1
+        job['worker_pid'] = worker_pid
+        return job
+
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error claiming ingestion job: {str(e)}")
+        raise
+
+    finally:
+        conn.close()
+
+def update_ingestion_job_progress(job_id: str, stage: str, progress: float, stage_timings: Dict[str, float]):
+    conn = get_db_connection()
+    conn.execute('''
+        UPDATE ingestion_jobs
+        SET stage = ?, progress = ?, stage_timings = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE job_id = ?
+    ''', (stage, progress, json.dumps(stage_timings), job_id))
+    conn.commit()
+    conn.close()
+
+def finish_ingestion_job(job_id: str, stage_timings: Dict[str, float], error: Optional[str] = None, result: Optional[Dict] = None):
+    """Mark a job as completed with its result summary, or as failed when an error message is given."""
+    conn = get_db_connection()
+    if error is None:
+        conn.execute('''
+            UPDATE ingestion_jobs
+            SET status = 'completed', stage = 'done', progress = 100, stage_timings = ?, result = ?,
+                error = NULL, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+        ''', (json.dumps(stage_timings), json.dumps(result or {}), job_id))
+    else:
+        conn.execute('''
+            UPDATE ingestion_jobs
+            SET status = 'failed', stage_timings = ?, error = ?,
+                finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+        ''', (json.dumps(stage_timings), error, job_id))
+    conn.commit()
+    conn.close()
+
+def add_ingestion_job_event(job_id: str, attempt: int, event: str, stage: Optional[str] = None,
+                            completed: Optional[int] = None, total: Optional[int] = None,
+                            progress: Optional[float] = None, stage_elapsed: Optional[float] = None,
+                            elapsed: Optional[float] = None):
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO ingestion_job_events
+            (job_id, attempt, event, stage, completed, total, progress, stage_elapsed, elapsed)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (job_id, attempt, event, stage, completed, total, progress, stage_elapsed, elapsed))
+    conn.commit()
+    conn.close()
+
+def get_ingestion_job_events(job_id: str, after_id: int = 0) -> List[Dict]:
+    """Return the job's events with an id greater than after_id, oldest first."""
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT * FROM ingestion_job_events
+        WHERE job_id = ? AND id > ?
+        ORDER BY id
+    ''', (job_id, after_id)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def retry_ingestion_job(job_id: str) -> bool:
+    """Put a failed job back on the queue. Returns False if the job is not in the failed state."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE ingestion_jobs
+        SET status = 'queued', stage = 'queued', progress = 0, error = NULL, worker_pid = NULL,
+            finished_at = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE job_id = ? AND status = 'failed'
+    ''', (job_id,))
+    retried = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return retried
+
+def get_latest_ingestion_job_id(pdf_id: int) -> Optional[str]:
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT job_id FROM ingestion_jobs
+        WHERE pdf_id = ?
+        ORDER BY created_at DESC, rowid DESC
+        LIMIT 1
+    ''', (pdf_id,)).fetchone()
+    conn.close()
+    return row['job_id'] if row else None
+
+def has_active_ingestion_job(pdf_id: int) -> bool:
+    """Whether a job for pdf_id is queued or running."""
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT 1 FROM ingestion_jobs
+        WHERE pdf_id = ? AND status IN ('queued', 'running')
+        LIMIT 1
+    ''', (pdf_id,)).fetchone()
+    conn.close()
+    return row is not None
+
+def get_ingestion_job(job_id: str) -> Optional[Dict]:
+    conn = get_db_connection()
+    row = conn.execute('SELECT * FROM ingestion_jobs WHERE job_id = ?', (job_id,)).fetchone()
+    conn.close()
+    return _job_row_to_dict(row) if row else None
+
+def requeue_interrupted_jobs() -> int:
+    """Put running jobs whose worker process has died back on the queue."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT job_id, worker_pid FROM ingestion_jobs WHERE status = 'running'")
+
+    requeued = 0
+    for row in cursor.fetchall():
+        if row['worker_pid'] and _process_alive(row['worker_pid']):
+            continue
+        cursor.execute('''
+            UPDATE ingestion_jobs
+            SET status = 'queued', stage = 'queued', progress = 0, worker_pid = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ? AND status = 'running'
+        ''', (row['job_id'],))
+        requeued += cursor.rowcount
+
+    conn.commit()
+    conn.close()
+
+    if requeued:
+        logging.info(f"Requeued {requeued} interrupted ingestion jobs")
+    return requeued
+
+def create_ingestion_batches():
+    conn = get_db_connection()
+    conn.execute('''CREATE TABLE IF NOT EXISTS ingestion_batches
+                    (batch_id TEXT PRIMARY KEY,
+                     user_id INTEGER,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE)''')
+
+    # One row per uploaded file, including the ones that never got a job (duplicates, rejects)
+    conn.execute('''CREATE TABLE IF NOT EXISTS ingestion_batch_files
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     batch_id TEXT NOT NULL,
+                     filename TEXT,
+                     status TEXT NOT NULL,
+                     pdf_id INTEGER,
+                     job_id TEXT,
+                     error TEXT,
+                     FOREIGN KEY (batch_id) REFERENCES ingestion_batches (batch_id) ON DELETE CASCADE)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingestion_batch_files_batch ON ingestion_batch_files(batch_id, id)')
+    conn.commit()
+    conn.close()
+
+def create_ingestion_batch(user_id: int) -> str:
+    batch_id = str(uuid.uuid4())
+    conn = get_db_connection()
+    conn.execute('INSERT INTO ingestion_batches (batch_id, user_id) VALUES (?, ?)', (batch_id, user_id))
+    conn.commit()
+    conn.close()
+    return batch_id
+
+def add_ingestion_batch_file(batch_id: str, filename: str, status: str, pdf_id: Optional[int] = None,
+                             job_id: Optional[str] = None, error: Optional[str] = None):
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO ingestion_batch_files (batch_id, filename, status, pdf_id, job_id, error)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (batch_id, filename, status, pdf_id, job_id, error))
+    conn.commit()
+    conn.close()
+
+def get_ingestion_batch(batch_id: str) -> Optional[Dict]:
+    """Return the batch manifest with each file's live job status and per-status counts."""
+    conn = get_db_connection()
+    batch = conn.execute('SELECT * FROM ingestion_batches WHERE batch_id = ?', (batch_id,)).fetchone()
+    if not batch:
+        conn.close()
+        return None
+
+    rows = conn.execute('''
+        SELECT f.filename, f.pdf_id, f.job_id,
+               COALESCE(j.status, f.status) AS status,
+               j.stage, COALESCE(j.progress, 0) AS progress,
+               COALESCE(j.error, f.error) AS error
+        FROM ingestion_batch_files f
+        LEFT JOIN ingestion_jobs j ON j.job_id = f.job_id
+        WHERE f.batch_id = ?
+        ORDER BY f.id
+    ''', (batch_id,)).fetchall()
+    conn.close()
+
+    files = [dict(row) for row in rows]
+    counts: Dict[str, int] = {}
+    for file in files:
+        counts[file['status']] = counts.get(file['status'], 0) + 1
+    return {
+        'batch_id': batch['batch_id'],
+        'user_id': batch['user_id'],
+        'created_at': batch['created_at'],
+        'counts': counts,
+        'files': files,
+    }
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
 # Initialize the database tables
 create_application_logs()
 create_document_store()
 create_users_table()
+create_ingestion_jobs()
+create_ingestion_batches()
+create_chunk_search()
+create_corpus_versions()
 
 def store_highlight(highlight_data: dict) -> str:
     """Store a highlight with its text content."""
@@ -527,8 +1254,8 @@ def store_highlight(highlight_data: dict) -> str:
             INSERT INTO highlights (
                 highlight_id, chat_id, pdf_id, content_text, 
                 position_json, comment_text, comment_emoji, 
-                filename, page_number
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                filename, page_number, chunk_id
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             highlight_data['highlight_id'],
             highlight_data['chat_id'],
@@ -538,7 +1265,8 @@ def store_highlight(highlight_data: dict) -> str:
             highlight_data['comment']['text'],
             highlight_data['comment']['emoji'],
             highlight_data['filename'],
-            highlight_data['position']['pageNumber']
+            highlight_data['position']['pageNumber'],
+            highlight_data.get('chunk_id')
         ))
         
         conn.commit()
@@ -659,6 +1387,13 @@ def create_or_get_chat(session_id: str, user_id: int, model: str, name: Optional
         logging.error(f"Error in create_or_get_chat: {str(e)}")
         raise
 
+def has_chat_messages(session_id: str) -> bool:
+    """Whether the chat already has a question and answer."""
+    conn = get_db_connection()
+    row = conn.execute('SELECT 1 FROM chat_messages WHERE session_id = ? LIMIT 1', (session_id,)).fetchone()
+    conn.close()
+    return row is not None
+
 def store_chat_message(session_id: str, user_query: str, gpt_response: str) -> int:
     """Store a new chat message."""
     try:
@@ -731,9 +1466,7 @@ def get_document_highlights(pdf_id: int, highlight_ids: List[str]) -> Dict:
         query = f'''
             SELECT h.*, c.chunk_text 
             FROM highlights h
-            LEFT JOIN document_chunks c ON 
-                c.doc_id = h.pdf_id AND 
-                c.page_number = h.page_number
+            LEFT JOIN document_chunks c ON c.id = h.chunk_id
             WHERE h.pdf_id = ? AND h.highlight_id IN ({placeholders})
             ORDER BY h.created_at
         '''
@@ -830,10 +1563,16 @@ def clear_all_data_except_users():
             tables_to_clear = [
                 'highlights',
                 'document_chunks',
+                'chunk_search',
                 'chat_messages',
                 'chats',
                 'application_logs',
+                'ingestion_batch_files',
+                'ingestion_batches',
+                'ingestion_job_events',
+                'ingestion_jobs',
                 'pdf_store',
+                'pdf_blobs',
                 'document_store'
             ]
             
@@ -842,13 +1581,17 @@ def clear_all_data_except_users():
                 rows_deleted = cursor.rowcount
                 logging.info(f"Deleted {rows_deleted} rows from {table}")
             
-            # Also delete the vector store
-            if os.path.exists("./chroma_db"):
-                shutil.rmtree("./chroma_db")
-                logging.info("Cleared vector store database")
-            
+            # Cached query results of every user are stale now
+            cursor.execute('UPDATE corpus_versions SET version = version + 1')
+
             # Commit transaction
             conn.commit()
+
+            # Also delete the vector store, through vector_store_db so its cached clients and collections go too.
+            # Imported here because vector_store_db imports this module
+            from services.vector_store_db import clear_vectorstore
+            if not clear_vectorstore():
+                raise RuntimeError("Failed to clear the vector store")
             logging.info("Successfully cleared all data while preserving user information")
             
         except Exception as e:
@@ -0,0 +1,99 @@
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from services.sqlite_cache import SQLiteLRUCache
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "256"))
+# float16 halves the cache again; the rounding is far below what changes a similarity ranking
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float32")
+
+
+def normalize_text(text: str) -> str:
+    """Fold the differences that don't change meaning: unicode forms and runs of whitespace."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def embedding_cache_key(model: str, text: str, kind: str = "document") -> str:
+    # Some models embed queries differently from documents, so the two never share an entry
+    return hashlib.sha256(f"{model}\x00{kind}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+def _encode_vector(vector: List[float]) -> tuple:
+    return np.asarray(vector, dtype=EMBEDDING_CACHE_DTYPE).tobytes(), EMBEDDING_CACHE_DTYPE
+
+
+def _decode_vector(row) -> List[float]:
+    # Entries keep the dtype they were written with, so changing EMBEDDING_CACHE_DTYPE doesn't invalidate them
+    return np.frombuffer(row['vector'], dtype=row['dtype']).astype(float).tolist()
+
+
+_cache = SQLiteLRUCache(
+    EMBEDDING_CACHE_PATH, "embeddings", "embedding_cache_stats",
+    columns=[("vector", "BLOB NOT NULL"), ("dtype", "TEXT NOT NULL")],
+    max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+    encode=_encode_vector, decode=_decode_vector, label="embedding",
+)
+
+
+def create_embedding_cache():
+    _cache.create()
+
+
+def get_cached_embeddings(cache_keys: List[str]) -> Dict[str, List[float]]:
+    """Look up vectors for the given keys, returning only the hits."""
+    return _cache.get(cache_keys)
+
+
+def put_cached_embeddings(vectors: Dict[str, List[float]]):
+    """Store vectors by key and evict least recently used ones past the size limit."""
+    _cache.put(vectors)
+
+
+def get_embedding_cache_stats() -> Dict:
+    return {**_cache.stats(), "dtype": EMBEDDING_CACHE_DTYPE}
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that only call the wrapped model for texts it hasn't embedded before."""
+
+    def __init__(self, embeddings: Embeddings, model: Optional[str] = None):
+        self.embeddings = embeddings
+        # Vectors from different models must never be mixed up
+        self.model = model or getattr(embeddings, "model", None) or type(embeddings).__name__
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_cache_key(self.model, text) for text in texts]
+        vectors = get_cached_embeddings(list(set(keys)))
+
+        # Texts repeated within the batch are sent once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        if missing:
+            embedded = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            put_cached_embeddings(embedded)
+            vectors.update(embedded)
+            logging.info(f"Embedding cache served {len(texts) - len(missing)} of {len(texts)} texts")
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = embedding_cache_key(self.model, text, kind="query")
+        vector = get_cached_embeddings([key]).get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            put_cached_embeddings({key: vector})
+        return vector
+
+
+# Initialize the cache tables
+create_embedding_cache()
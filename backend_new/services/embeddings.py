@@ -0,0 +1,175 @@
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, TypeVar
+
+import httpx
+import openai
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+from langchain_openai import OpenAIEmbeddings
+
+from services.summarization import retry_delay
+
+# Which embedding model this deployment uses: "openai", "ollama" (e.g. nomic-embed-text) or "local" (sentence-transformers on CPU)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai").lower()
+DEFAULT_EMBEDDING_MODELS = {
+    "openai": "text-embedding-ada-002",
+    "ollama": "nomic-embed-text",
+    "local": "sentence-transformers/all-MiniLM-L6-v2",
+}
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") or DEFAULT_EMBEDDING_MODELS.get(EMBEDDING_PROVIDER)
+# Output size; models that can't shorten their vectors natively are truncated and re-normalized (Matryoshka style)
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+# Texts per call to the model, whichever provider it is
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+# Embedding requests in flight per document; a local model already keeps the CPU busy with one
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "1" if EMBEDDING_PROVIDER == "local" else "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+
+# What every collection was embedded with before the provider became configurable
+LEGACY_EMBEDDING_MODEL_ID = "openai:text-embedding-ada-002"
+
+
+def embedding_model_id() -> str:
+    """Identify the configured model and output size; vectors with different ids must never share a collection."""
+    model_id = f"{EMBEDDING_PROVIDER}:{EMBEDDING_MODEL}"
+    return f"{model_id}@{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else model_id
+
+
+def _truncate(vector: List[float], dimensions: Optional[int]) -> List[float]:
+    if not dimensions or len(vector) <= dimensions:
+        return vector
+    vector = vector[:dimensions]
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class BatchedEmbeddings(Embeddings):
+    """Send texts to the wrapped model EMBED_BATCH_SIZE at a time, truncating vectors to dimensions."""
+
+    def __init__(self, embeddings: Embeddings, batch_size: int = EMBED_BATCH_SIZE, dimensions: Optional[int] = None):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.embeddings.embed_documents(texts[start:start + self.batch_size]))
+        return [_truncate(vector, self.dimensions) for vector in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        return _truncate(self.embeddings.embed_query(text), self.dimensions)
+
+
+class LocalEmbeddings(Embeddings):
+    """A sentence-transformers model running in this process, so no text leaves the machine."""
+
+    def __init__(self, model: str, dimensions: Optional[int] = None, batch_size: int = EMBED_BATCH_SIZE):
+        # Only deployments that pick the local provider need sentence-transformers installed
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model, device=EMBEDDING_DEVICE, truncate_dim=dimensions)
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class RetryingEmbeddings(Embeddings):
+    """Retry the wrapped model's query embeddings on transient errors.
+
+    Document batches aren't retried here, since embed_batches already retries each one.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return with_retries(lambda: self.embeddings.embed_query(text), "Query embedding")
+
+
+def get_embeddings() -> Embeddings:
+    """Build the configured embedding model."""
+    logging.info(f"Using embedding model {embedding_model_id()}")
+    return RetryingEmbeddings(_build_embeddings())
+
+
+def _build_embeddings() -> Embeddings:
+    if EMBEDDING_PROVIDER == "openai":
+        # OpenAI batches and shortens vectors (text-embedding-3 models) itself; retries happen in with_retries
+        return OpenAIEmbeddings(model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS, chunk_size=EMBED_BATCH_SIZE,
+                                max_retries=0)
+    if EMBEDDING_PROVIDER == "ollama":
+        return BatchedEmbeddings(
+            OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL),
+            dimensions=EMBEDDING_DIMENSIONS
+        )
+    if EMBEDDING_PROVIDER == "local":
+        return LocalEmbeddings(EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS)
+    raise ValueError(f"Unknown EMBEDDING_PROVIDER: {EMBEDDING_PROVIDER}")
+
+
+# Errors worth retrying: timeouts, dropped connections, rate limits and server errors. Anything else (bad input,
+# auth, a bug in a local model) would fail the same way again
+_TRANSIENT_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError,
+                     openai.InternalServerError, httpx.TimeoutException, httpx.NetworkError, TimeoutError,
+                     ConnectionError)
+
+T = TypeVar("T")
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return True
+    # Ollama reports HTTP errors as a ResponseError with the status
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+def with_retries(call: Callable[[], T], description: str) -> T:
+    """Run call, retrying transient errors up to EMBED_MAX_RETRIES times with Retry-After-aware backoff."""
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = retry_delay(e, attempt)
+            logging.warning(f"{description} failed ({str(e)}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def embed_batches(embeddings: Embeddings, batches: List[List[str]],
+                  result_callback: Callable[[int, List[List[float]]], None],
+                  concurrency: int = EMBED_CONCURRENCY):
+    """Embed batches with up to concurrency requests in flight, retrying failed ones with backoff.
+
+    result_callback is called on the calling thread as (index, vectors) as each batch finishes, in completion order.
+    """
+    def run(index: int):
+        return index, with_retries(lambda: embeddings.embed_documents(batches[index]), f"Embedding batch {index}")
+
+    if not batches:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches))), thread_name_prefix="embed") as pool:
+        futures = [pool.submit(run, index) for index in range(len(batches))]
+        try:
+            for future in as_completed(futures):
+                result_callback(*future.result())
+        except Exception:
+            # Don't start batches whose results can no longer be used
+            for future in futures:
+                future.cancel()
+            raise
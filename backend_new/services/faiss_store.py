@@ -0,0 +1,462 @@
+import fcntl
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Each collection keeps its index and a SQLite file of ids, texts and metadata in FAISS_DIR/<collection name>/
+FAISS_DIR = os.getenv("FAISS_DIR", "./faiss_db")
+# "flat" searches exactly; "hnsw" is a graph, fast at any size; "ivf" clusters vectors and searches the nearest
+# clusters, once enough vectors are compacted together to train them
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+# Clusters per IVF index (0: 4 * sqrt(vectors) when it is trained) and clusters searched per query
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "0"))
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+# A segment stays flat until it holds this many vectors to train IVF clusters on
+FAISS_IVF_MIN_TRAIN = int(os.getenv("FAISS_IVF_MIN_TRAIN", "10000"))
+# Vectors buffered before they are written out as a new segment
+FAISS_FLUSH_VECTORS = int(os.getenv("FAISS_FLUSH_VECTORS", "5000"))
+# Segments are merged in the background once there are more than this many,
+# or once this share of the vectors in them is deleted or superseded
+FAISS_MAX_SEGMENTS = int(os.getenv("FAISS_MAX_SEGMENTS", "8"))
+FAISS_COMPACT_RATIO = float(os.getenv("FAISS_COMPACT_RATIO", "0.2"))
+
+
+def _faiss():
+    # Only deployments that pick the FAISS backend need faiss installed
+    import faiss
+    return faiss
+
+
+def faiss_id(vector_id: str) -> int:
+    """Map a vector id to the positive 63-bit integer FAISS stores it under."""
+    return int.from_bytes(hashlib.sha256(vector_id.encode("utf-8")).digest()[:8], "big") >> 1
+
+
+def _normalized(vectors) -> np.ndarray:
+    # Inner product on unit vectors is cosine similarity
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _where_sql(where: Dict) -> tuple:
+    """Translate a Chroma where filter (equality, $eq and $and) into SQL over the vectors table."""
+    if "$and" in where:
+        parts = [_where_sql(clause) for clause in where["$and"]]
+        return " AND ".join(f"({sql})" for sql, _ in parts), [param for _, params in parts for param in params]
+    if len(where) != 1:
+        return _where_sql({"$and": [{key: value} for key, value in where.items()]})
+    (key, value), = where.items()
+    if isinstance(value, dict):
+        if set(value) != {"$eq"}:
+            raise ValueError(f"Unsupported filter on {key}: {value}")
+        value = value["$eq"]
+    if key in ("file_id", "user_id"):
+        return f"{key} = ?", [value]
+    if not re.fullmatch(r"\w+", key):
+        raise ValueError(f"Unsupported metadata key: {key}")
+    return f"json_extract(metadata, '$.{key}') = ?", [value]
+
+
+class FaissCollection:
+    """FAISS indexes on disk with the parts of Chroma's collection API the app uses.
+
+    Vectors are written in immutable segments, one per flush, so a write never touches what is already on disk.
+    Texts, metadata and the segment holding each vector's current copy live in a SQLite file next to the
+    segments; a vector found in any other segment was deleted or superseded and is skipped. Readers memory-map
+    the segments, so every worker on the node shares one copy of them in the page cache. A background thread
+    merges the segments into one and drops the dead vectors once they pile up.
+    """
+
+    def __init__(self, name: str, directory: str = FAISS_DIR):
+        self.name = name
+        self.directory = os.path.join(directory, name)
+        self.db_path = os.path.join(self.directory, "vectors.db")
+        self.lock_path = os.path.join(self.directory, "write.lock")
+
+        # segment -> (identity of its file, memory-mapped index); segments never change once written
+        self._readers: Dict[int, tuple] = {}
+        # vector_id -> (vector, document, metadata), waiting for the next flush
+        self._pending: Dict[str, tuple] = {}
+        self._lock = threading.RLock()
+        self._compactor: Optional[threading.Thread] = None
+
+        self._create()
+
+    def _create(self):
+        os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS vectors
+                        (faiss_id INTEGER PRIMARY KEY,
+                         vector_id TEXT UNIQUE NOT NULL,
+                         segment INTEGER NOT NULL,
+                         file_id INTEGER,
+                         user_id INTEGER,
+                         document TEXT,
+                         metadata TEXT)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_vectors_file ON vectors(file_id, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_vectors_segment ON vectors(segment)')
+        conn.execute('''CREATE TABLE IF NOT EXISTS segments
+                        (segment INTEGER PRIMARY KEY AUTOINCREMENT,
+                         vectors INTEGER NOT NULL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS collection_metadata
+                        (key TEXT PRIMARY KEY,
+                         value TEXT)''')
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        if not os.path.exists(self.db_path):
+            # clear_vectorstore removed the collection while this handle was open; start it again empty
+            self._create()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:08d}.faiss")
+
+    @property
+    def metadata(self) -> Dict:
+        conn = self._connect()
+        metadata = {row['key']: json.loads(row['value']) for row in conn.execute('SELECT key, value FROM collection_metadata')}
+        conn.close()
+        return metadata
+
+    def modify(self, metadata: Dict):
+        conn = self._connect()
+        conn.executemany('INSERT OR REPLACE INTO collection_metadata (key, value) VALUES (?, ?)',
+                         [(key, json.dumps(value)) for key, value in metadata.items()])
+        conn.commit()
+        conn.close()
+
+    def count(self) -> int:
+        self.flush()
+        conn = self._connect()
+        count = conn.execute('SELECT COUNT(*) FROM vectors').fetchone()[0]
+        conn.close()
+        return count
+
+    # Reading
+
+    @contextmanager
+    def _snapshot(self):
+        """A connection in a read transaction and the segments it sees, memory-mapped.
+
+        Rows read in the transaction always point at segments in the snapshot, even while a compaction swaps them.
+        """
+        while True:
+            conn = self._connect()
+            conn.isolation_level = None
+            conn.execute('BEGIN')
+            try:
+                segments = [row[0] for row in conn.execute('SELECT segment FROM segments ORDER BY segment')]
+                try:
+                    indexes = {segment: self._reader(segment) for segment in segments}
+                except FileNotFoundError:
+                    # A compaction removed a segment after this snapshot was taken; take a newer one
+                    continue
+                with self._lock:
+                    for segment in set(self._readers) - set(segments):
+                        del self._readers[segment]
+                yield conn, indexes
+                return
+            finally:
+                conn.execute('COMMIT')
+                conn.close()
+
+    def _reader(self, segment: int):
+        with self._lock:
+            path = self._segment_path(segment)
+            # A recreated collection numbers its segments from 1 again; only reuse a mapping of the same file
+            stat = os.stat(path)
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            cached = self._readers.get(segment)
+            if cached is not None and cached[0] == identity:
+                return cached[1]
+            faiss = _faiss()
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            try:
+                reader = faiss.read_index(path, flags)
+            except RuntimeError:
+                if not os.path.exists(path):
+                    raise FileNotFoundError(path)
+                raise
+            self._tune(reader)
+            self._readers[segment] = (identity, reader)
+            return reader
+
+    def _tune(self, index):
+        faiss = _faiss()
+        parameters = faiss.ParameterSpace()
+        for name, value in (("efSearch", FAISS_HNSW_EF_SEARCH), ("nprobe", FAISS_IVF_NPROBE)):
+            try:
+                parameters.set_index_parameter(index, name, value)
+            except RuntimeError:
+                # Not a parameter of this index type
+                pass
+
+    def _rows(self, conn, faiss_ids: Iterable[int]) -> Dict[int, sqlite3.Row]:
+        rows = {}
+        faiss_ids = list(faiss_ids)
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(faiss_ids), 500):
+            batch = faiss_ids[start:start + 500]
+            placeholders = ','.join('?' for _ in batch)
+            for row in conn.execute(f'SELECT * FROM vectors WHERE faiss_id IN ({placeholders})', batch):
+                rows[row['faiss_id']] = row
+        return rows
+
+    def _result(self, rows: List[sqlite3.Row], include: Iterable[str], indexes: Dict[int, object]) -> Dict:
+        result = {"ids": [row['vector_id'] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [row['document'] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(row['metadata'] or '{}') for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [indexes[row['segment']].reconstruct(row['faiss_id']).tolist() for row in rows]
+        return result
+
+    def _select(self, conn, ids: Optional[List[str]] = None, where: Optional[Dict] = None,
+                limit: Optional[int] = None, offset: Optional[int] = None) -> List[sqlite3.Row]:
+        if ids is not None and not ids:
+            return []
+        clauses, params = [], []
+        if ids is not None:
+            clauses.append(f"vector_id IN ({','.join('?' for _ in ids)})")
+            params.extend(ids)
+        if where:
+            sql, where_params = _where_sql(where)
+            clauses.append(sql)
+            params.extend(where_params)
+        sql = 'SELECT * FROM vectors'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY faiss_id'
+        if limit is not None or offset:
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend([limit if limit is not None else -1, offset or 0])
+        return conn.execute(sql, params).fetchall()
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include: Iterable[str] = ("documents", "metadatas")) -> Dict:
+        self.flush()
+        with self._snapshot() as (conn, indexes):
+            rows = self._select(conn, ids, where, limit, offset)
+            return self._result(rows, include, indexes)
+
+    def _search(self, conn, indexes: Dict[int, object], query_embedding: List[float], n_results: int) -> List[tuple]:
+        """The n_results nearest live vectors as (row, distance), searching wider until dead ones are skipped."""
+        query = _normalized([query_embedding])
+        total = sum(index.ntotal for index in indexes.values())
+        fetch = n_results * 2
+        while True:
+            found = []
+            for segment, index in indexes.items():
+                if index.ntotal:
+                    similarities, ids = index.search(query, min(index.ntotal, fetch))
+                    found.extend((float(similarity), int(i), segment)
+                                 for similarity, i in zip(similarities[0], ids[0]) if i >= 0)
+            found.sort(key=lambda hit: -hit[0])
+            rows = self._rows(conn, {i for _, i, _ in found})
+            hits = [(rows[i], 1.0 - similarity) for similarity, i, segment in found
+                    if i in rows and rows[i]['segment'] == segment]
+            if len(hits) >= n_results or fetch >= total:
+                return hits[:n_results]
+            fetch *= 2
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10,
+              include: Iterable[str] = ("documents", "metadatas", "distances")) -> Dict:
+        self.flush()
+        results = {key: [] for key in ("ids", "documents", "metadatas", "embeddings", "distances")}
+        with self._snapshot() as (conn, indexes):
+            for query_embedding in query_embeddings:
+                hits = self._search(conn, indexes, query_embedding, n_results)
+                result = self._result([row for row, _ in hits], include, indexes)
+                for key in ("ids", "documents", "metadatas", "embeddings"):
+                    if key in result:
+                        results[key].append(result[key])
+                results["distances"].append([distance for _, distance in hits])
+        return {key: value for key, value in results.items() if key == "ids" or key in include}
+
+    # Writing
+
+    @contextmanager
+    def _write_lock(self):
+        # One writer at a time per collection, across the threads and processes of the node
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                self._create()
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _new_index(self, vectors: np.ndarray, ids: np.ndarray):
+        faiss = _faiss()
+        dimensions = vectors.shape[1]
+        if FAISS_INDEX_TYPE == "hnsw":
+            index = faiss.IndexIDMap2(faiss.IndexHNSWFlat(dimensions, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT))
+        elif FAISS_INDEX_TYPE == "ivf" and len(vectors) >= FAISS_IVF_MIN_TRAIN:
+            nlist = FAISS_IVF_NLIST or max(1, int(4 * math.sqrt(len(vectors))))
+            quantizer = faiss.IndexFlatIP(dimensions)
+            index = faiss.IndexIVFFlat(quantizer, dimensions, nlist, faiss.METRIC_INNER_PRODUCT)
+            # The IVF index frees its quantizer, not Python
+            index.own_fields = True
+            quantizer.this.disown()
+            index.train(vectors)
+            # Lets vectors be looked up by id
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        elif FAISS_INDEX_TYPE in ("flat", "ivf"):
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimensions))
+        else:
+            raise ValueError(f"Unknown FAISS_INDEX_TYPE: {FAISS_INDEX_TYPE}")
+        index.add_with_ids(vectors, ids)
+        return index
+
+    def _write_segment(self, conn, vectors: np.ndarray, ids: np.ndarray) -> int:
+        """Write vectors out as a new segment and register it in conn's open transaction."""
+        segment = conn.execute('INSERT INTO segments (vectors) VALUES (?)', (len(ids),)).lastrowid
+        path = self._segment_path(segment)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        _faiss().write_index(self._new_index(vectors, ids), tmp_path)
+        os.replace(tmp_path, path)
+        return segment
+
+    def upsert(self, ids: List[str], embeddings, documents: Optional[List[str]] = None,
+               metadatas: Optional[List[Dict]] = None):
+        """Buffer vectors to add or replace; they are written out every FAISS_FLUSH_VECTORS and before any read."""
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        with self._lock:
+            for vector_id, vector, document, metadata in zip(ids, embeddings, documents, metadatas):
+                self._pending[vector_id] = (vector, document, metadata)
+            full = len(self._pending) >= FAISS_FLUSH_VECTORS
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+
+            vector_ids = list(pending)
+            new_ids = np.array([faiss_id(vector_id) for vector_id in vector_ids], dtype=np.int64)
+            vectors = _normalized([pending[vector_id][0] for vector_id in vector_ids])
+            with self._write_lock():
+                conn = self._connect()
+                try:
+                    segment = self._write_segment(conn, vectors, new_ids)
+                    # Earlier copies of these vectors stay in their segments, dead, until the next compaction
+                    conn.executemany('''
+                        INSERT OR REPLACE INTO vectors (faiss_id, vector_id, segment, file_id, user_id, document, metadata)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', [
+                        (int(i), vector_id, segment, metadata.get("file_id"), metadata.get("user_id"), document,
+                         json.dumps(metadata))
+                        for i, vector_id in zip(new_ids, vector_ids)
+                        for _, document, metadata in [pending[vector_id]]
+                    ])
+                    conn.commit()
+                finally:
+                    conn.close()
+            logging.info(f"Wrote {len(vector_ids)} vectors to segment {segment} of FAISS collection {self.name}")
+        self._compact_if_needed()
+
+    def update(self, ids: List[str], metadatas: List[Dict]):
+        self.flush()
+        conn = self._connect()
+        conn.executemany('UPDATE vectors SET metadata = ?, file_id = ?, user_id = ? WHERE vector_id = ?', [
+            (json.dumps(metadata), metadata.get("file_id"), metadata.get("user_id"), vector_id)
+            for vector_id, metadata in zip(ids, metadatas)
+        ])
+        conn.commit()
+        conn.close()
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        self.flush()
+        # Deleting the rows is enough to hide the vectors; compaction drops them from disk
+        conn = self._connect()
+        removed = [row['faiss_id'] for row in self._select(conn, ids, where)]
+        conn.executemany('DELETE FROM vectors WHERE faiss_id = ?', [(i,) for i in removed])
+        conn.commit()
+        conn.close()
+        if removed:
+            logging.info(f"Deleted {len(removed)} vectors from FAISS collection {self.name}")
+            self._compact_if_needed()
+
+    # Compaction
+
+    def _compact_if_needed(self):
+        conn = self._connect()
+        segments, stored = conn.execute('SELECT COUNT(*), COALESCE(SUM(vectors), 0) FROM segments').fetchone()
+        live = conn.execute('SELECT COUNT(*) FROM vectors').fetchone()[0]
+        conn.close()
+        if segments > FAISS_MAX_SEGMENTS or (stored and (stored - live) / stored > FAISS_COMPACT_RATIO):
+            with self._lock:
+                if self._compactor is None or not self._compactor.is_alive():
+                    self._compactor = threading.Thread(target=self.compact, name=f"faiss-compact-{self.name}", daemon=True)
+                    self._compactor.start()
+
+    def compact(self):
+        """Merge every segment into one holding only the live vectors.
+
+        The merged segment is built without holding the write lock, so writes carry on meanwhile; vectors
+        rewritten or deleted in the meantime keep their newer state.
+        """
+        try:
+            with self._snapshot() as (conn, indexes):
+                merged = list(indexes)
+                ids, vectors = [], []
+                for segment, index in indexes.items():
+                    live = np.array([row[0] for row in conn.execute('SELECT faiss_id FROM vectors WHERE segment = ?', (segment,))],
+                                    dtype=np.int64)
+                    if len(live):
+                        ids.append(live)
+                        vectors.append(index.reconstruct_batch(live))
+            if not merged:
+                return
+
+            with self._write_lock():
+                conn = self._connect()
+                try:
+                    placeholders = ','.join('?' for _ in merged)
+                    current = conn.execute(f'SELECT COUNT(*) FROM segments WHERE segment IN ({placeholders})', merged).fetchone()[0]
+                    if current != len(merged):
+                        # Another process compacted these segments first
+                        return
+                    if ids:
+                        segment = self._write_segment(conn, np.concatenate(vectors), np.concatenate(ids))
+                        conn.execute(f'UPDATE vectors SET segment = ? WHERE segment IN ({placeholders})', [segment, *merged])
+                    conn.execute(f'DELETE FROM segments WHERE segment IN ({placeholders})', merged)
+                    conn.commit()
+                    kept = {row[0] for row in conn.execute('SELECT segment FROM segments')}
+                finally:
+                    conn.close()
+                # Readers that mapped a removed segment keep it until they next look; files left by a write
+                # that died before registering its segment go too
+                for name in os.listdir(self.directory):
+                    match = re.fullmatch(r"segment-(\d+)\.faiss(\.\d+\.tmp)?", name)
+                    if match and (match.group(2) or int(match.group(1)) not in kept):
+                        os.remove(os.path.join(self.directory, name))
+            logging.info(f"Compacted {len(merged)} segments of FAISS collection {self.name} into one of "
+                         f"{sum(len(i) for i in ids)} vectors")
+
+        except Exception as e:
+            # The segments stay as they are and the next write tries again
+            logging.error(f"Error compacting FAISS collection {self.name}: {str(e)}")
@@ -0,0 +1,367 @@
+import fcntl
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from services.database import (
+    add_ingestion_job_event,
+    claim_next_ingestion_job,
+    copy_document_chunks,
+    find_indexed_pdf_by_hash,
+    copy_pdf_to_file,
+    finish_ingestion_job,
+    get_pdf_version,
+    mark_pdf_indexed,
+    requeue_interrupted_jobs,
+    store_document_chunks,
+    update_ingestion_job_progress,
+)
+from services.checkpoints import DocumentCheckpoint
+from services.ocr import shutdown_ocr_pool, warm_up_ocr
+from services.vector_store_db import copy_doc_in_chroma, index_document_to_chroma, process_pdf, vector_writes_need_one_process
+from services.workspace import ingestion_workspace
+
+# Number of background processes pulling jobs off the ingestion queue
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+# Jobs each worker runs at once. They share its OCR pool, so one document's OCR overlaps
+# another's summaries and embeddings instead of the pool idling between documents.
+INGEST_JOBS_PER_WORKER = int(os.getenv("INGEST_JOBS_PER_WORKER", "2"))
+# Seconds an idle worker sleeps before polling the queue again
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "1.0"))
+# Held by the one web process that runs the workers, however many web processes serve the API
+INGEST_LOCK_PATH = os.getenv("INGEST_LOCK_PATH", "ingestion.lock")
+# Longest wait, in seconds, between retries of an OCR warm-up that failed
+INGEST_WARMUP_MAX_DELAY = float(os.getenv("INGEST_WARMUP_MAX_DELAY", "300"))
+
+# Share of the overall progress bar each stage accounts for, in pipeline order
+STAGE_WEIGHTS = {
+    "split": 5,
+    "ocr": 50,
+    "summarize": 30,
+    "chunk": 5,
+    "index": 10,
+}
+
+# Worker processes, or the thread running the workers inside this process when vectors are embedded Chroma
+_worker_processes: List = []
+# Set by each worker once its OCR models are loaded
+_worker_ready_events: List = []
+# Tells in-process job loops to stop; worker processes are terminated instead
+_stop_event = threading.Event()
+_lock_file = None
+
+
+class JobProgress:
+    """Turn (stage, completed, total) reports into job progress, per-stage timings and progress events."""
+
+    def __init__(self, job_id: str, attempt: int = 0):
+        self.job_id = job_id
+        self.attempt = attempt
+        self.started = time.monotonic()
+        self.stage = None
+        self.stage_started = None
+        self.stage_timings: Dict[str, float] = {}
+
+    def _emit(self, event: str, stage: str, completed: Optional[int] = None, total: Optional[int] = None,
+              progress: Optional[float] = None, stage_elapsed: Optional[float] = None):
+        try:
+            add_ingestion_job_event(
+                self.job_id, self.attempt, event, stage,
+                completed=completed, total=total, progress=progress,
+                stage_elapsed=stage_elapsed, elapsed=round(time.monotonic() - self.started, 3)
+            )
+        except Exception as e:
+            # Subscribers miss an update; the job itself carries on
+            logging.error(f"Could not record {event} event for job {self.job_id}: {str(e)}")
+
+    def _close_stage(self):
+        if self.stage is not None:
+            elapsed = time.monotonic() - self.stage_started
+            self.stage_timings[self.stage] = round(self.stage_timings.get(self.stage, 0.0) + elapsed, 3)
+            self._emit("stage_finished", self.stage, stage_elapsed=round(elapsed, 3))
+
+    def _percent(self, stage: str, completed: int, total: int) -> float:
+        stages = list(STAGE_WEIGHTS)
+        done = sum(STAGE_WEIGHTS[s] for s in stages[:stages.index(stage)]) if stage in STAGE_WEIGHTS else 0
+        fraction = completed / total if total else 1.0
+        return round(100.0 * (done + STAGE_WEIGHTS.get(stage, 0) * fraction) / sum(STAGE_WEIGHTS.values()), 1)
+
+    def report(self, stage: str, completed: int, total: int):
+        event = "progress"
+        if stage != self.stage:
+            self._close_stage()
+            self.stage = stage
+            self.stage_started = time.monotonic()
+            event = "stage_started"
+
+        stage_elapsed = round(time.monotonic() - self.stage_started, 3)
+        percent = self._percent(stage, completed, total)
+        timings = dict(self.stage_timings)
+        timings[stage] = round(timings.get(stage, 0.0) + stage_elapsed, 3)
+        update_ingestion_job_progress(self.job_id, stage, percent, timings)
+        self._emit(event, stage, completed, total, percent, stage_elapsed)
+
+    def finish(self) -> Dict[str, float]:
+        self._close_stage()
+        self.stage = None
+        return self.stage_timings
+
+
+def run_ingestion_job(job: Dict):
+    """Run OCR, summarization and indexing for one claimed job, resuming from any checkpoints of earlier attempts."""
+    job_id = job["job_id"]
+    pdf_id = job["pdf_id"]
+    user_id = job["user_id"]
+    progress = JobProgress(job_id, job["attempts"])
+
+    logging.info(f"Starting ingestion job {job_id} for PDF {pdf_id} (attempt {job['attempts']})")
+    try:
+        # Re-indexing a revised upload keeps what it shares with the indexed version and bumps the version once done
+        version = get_pdf_version(pdf_id) + 1
+
+        # Identical bytes were already ingested for someone else: reuse their chunks and embeddings
+        source = find_indexed_pdf_by_hash(pdf_id)
+        if source:
+            progress.report("index", 0, 1)
+            chunk_id_map = copy_document_chunks(source["id"], pdf_id)
+            vectors = copy_doc_in_chroma(source["id"], source["user_id"], pdf_id, user_id, chunk_id_map)
+            if vectors:
+                progress.report("index", 1, 1)
+                mark_pdf_indexed(pdf_id, version)
+                finish_ingestion_job(job_id, progress.finish(), result={"reused_pdf_id": source["id"], "version": version, **vectors})
+                logging.info(f"Ingestion job {job_id} reused chunks of PDF {source['id']}")
+                return
+
+        # Finished pages and summaries survive a failed attempt (embedding batches are already in Chroma); scratch files don't
+        checkpoint = DocumentCheckpoint(pdf_id)
+
+        # Everything this job writes lives in its own workspace, so concurrent jobs can't collide
+        with ingestion_workspace(prefix=f"ingest-{pdf_id}-") as workspace_dir:
+            pdf_path = os.path.join(workspace_dir, "source.pdf")
+            filename = copy_pdf_to_file(pdf_id, user_id, pdf_path)
+            if filename is None:
+                raise Exception(f"PDF {pdf_id} not found for user {user_id}")
+
+            # Process the PDF and get chunks
+            result = process_pdf(pdf_path, workspace_dir, progress_callback=progress.report, checkpoint=checkpoint)
+
+        # Layout chunks go to document_chunks first, so their vectors can carry the row ids.
+        # Chunks whose text is unchanged since the last version keep their rows.
+        chunks = result["chunks"]
+        for chunk, chunk_id in zip(chunks, store_document_chunks(pdf_id, chunks)):
+            chunk["chunk_id"] = chunk_id
+
+        # Index in vector database, handing the summaries and chunks over in memory; only new text is embedded
+        progress.report("index", 0, 1)
+        vectors = index_document_to_chroma(
+            file_id=pdf_id,
+            file_path=filename,
+            user_id=user_id,
+            text=result["section_summaries"],
+            chunks=chunks,
+            progress_callback=lambda completed, total: progress.report("index", completed, total)
+        )
+        if not vectors:
+            raise Exception("Failed to index document in vector store")
+        progress.report("index", 1, 1)
+
+        job_result = {
+            "total_pages": result["total_pages"],
+            "native_pages": result["native_pages"],
+            "ocr_pages": result["ocr_pages"],
+            "ocr_cache_hits": result["ocr_cache_hits"],
+            "resumed_pages": result["resumed_pages"],
+            "resumed_summaries": result["resumed_summaries"],
+            "chunks": len(result["chunks"]),
+            "version": version,
+            **vectors,
+        }
+        mark_pdf_indexed(pdf_id, version)
+        # Summaries stay for the next version: unchanged sections then get the same summary and keep its vectors
+        checkpoint.clear(keep_kinds=("summaries",))
+        checkpoint.prune("summaries", result["summary_keys"])
+        finish_ingestion_job(job_id, progress.finish(), result=job_result)
+        logging.info(f"Ingestion job {job_id} completed: {job_result}, timings {progress.stage_timings}")
+
+    except Exception as e:
+        logging.error(f"Ingestion job {job_id} failed: {str(e)}")
+        logging.error("Full error details:", exc_info=True)
+        finish_ingestion_job(job_id, progress.finish(), error=str(e))
+
+
+def _handle_sigterm(signum, frame):
+    raise SystemExit(0)
+
+
+def _job_loop():
+    while not _stop_event.is_set():
+        try:
+            job = claim_next_ingestion_job(os.getpid())
+        except Exception as e:
+            logging.error(f"Could not poll ingestion queue: {str(e)}")
+            job = None
+
+        if job is None:
+            time.sleep(INGEST_POLL_INTERVAL)
+            continue
+
+        try:
+            run_ingestion_job(job)
+        except Exception as e:
+            # Its own bookkeeping failed (e.g. the database stayed locked); this slot must keep taking jobs
+            logging.error(f"Ingestion job {job['job_id']} crashed: {str(e)}", exc_info=True)
+            try:
+                finish_ingestion_job(job["job_id"], {}, error=str(e))
+            except Exception as finish_error:
+                # Left running under this pid; requeue_interrupted_jobs picks it up on the next start
+                logging.error(f"Could not mark ingestion job {job['job_id']} failed: {str(finish_error)}")
+
+
+def _worker_main(worker_index: int, ready_event):
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - %(levelname)s - [ingest-{worker_index} %(threadName)s] %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    logging.info(f"Ingestion worker {worker_index} started with pid {os.getpid()}")
+
+    # Turn terminate() into SystemExit so the OCR pool below is shut down with us
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    _serve(ready_event, max(1, INGEST_JOBS_PER_WORKER))
+
+
+def _retry_warm_up(ready_event):
+    """Keep trying to load the OCR models, marking the worker ready once they load.
+
+    Once a job has loaded them on first use, the next attempt finds them loaded and succeeds at once.
+    """
+    attempt = 0
+    while not _stop_event.wait(min(INGEST_WARMUP_MAX_DELAY, 10 * 2 ** attempt)):
+        try:
+            warm_up_ocr()
+            ready_event.set()
+            logging.info("OCR warm-up succeeded on retry")
+            return
+        except BrokenProcessPool as e:
+            # A pool whose workers died loading models never recovers; start a new one next time
+            logging.error(f"OCR warm-up failed: {str(e)}")
+            shutdown_ocr_pool()
+        except Exception as e:
+            logging.error(f"OCR warm-up failed: {str(e)}")
+        attempt += 1
+
+
+def _serve(ready_event, slots: int):
+    try:
+        # Load models before taking jobs so the first upload after a deploy isn't paying for it
+        try:
+            warm_up_ocr()
+            ready_event.set()
+        except Exception as e:
+            logging.error(f"OCR warm-up failed, models will load on first job; retrying in the background: {str(e)}")
+            if isinstance(e, BrokenProcessPool):
+                shutdown_ocr_pool()
+            threading.Thread(target=_retry_warm_up, args=(ready_event,), name="ocr-warm-up", daemon=True).start()
+
+        # Daemon threads: on SIGTERM the main thread exits and takes them along; their jobs are requeued on restart
+        threads = [
+            threading.Thread(target=_job_loop, name=f"job-{slot}", daemon=True)
+            for slot in range(slots)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        shutdown_ocr_pool()
+
+
+def _acquire_worker_lock() -> bool:
+    global _lock_file
+    lock_file = open(INGEST_LOCK_PATH, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    # Released when this process exits, so a restarted web process can take over
+    _lock_file = lock_file
+    return True
+
+
+def start_ingestion_workers(count: Optional[int] = None):
+    """Spawn the background ingestion workers, recovering jobs left behind by dead ones.
+
+    Only the first web process to start runs workers; the others leave the shared queue to it. With embedded
+    Chroma the workers run as threads of that web process, which then does every vector write itself.
+    """
+    if not _acquire_worker_lock():
+        logging.info("Ingestion workers run in another web process")
+        return
+    requeue_interrupted_jobs()
+
+    count = INGEST_WORKERS if count is None else count
+    _stop_event.clear()
+    if vector_writes_need_one_process():
+        # Embedded Chroma in worker processes would write behind the back of this process's loaded index
+        ready_event = threading.Event()
+        thread = threading.Thread(
+            target=_serve, args=(ready_event, max(1, count * INGEST_JOBS_PER_WORKER)),
+            name="ingest-in-process", daemon=True
+        )
+        thread.start()
+        _worker_processes.append(thread)
+        _worker_ready_events.append(ready_event)
+        logging.info("Started ingestion in the web process (set CHROMA_HOST to run worker processes)")
+        return
+
+    # spawn rather than fork: the API process holds threads and open SQLite/Chroma handles
+    ctx = multiprocessing.get_context("spawn")
+    for i in range(count):
+        # Not daemonic: daemonic processes may not start the OCR process pool
+        ready_event = ctx.Event()
+        process = ctx.Process(target=_worker_main, args=(i, ready_event), name=f"ingest-worker-{i}")
+        process.start()
+        _worker_processes.append(process)
+        _worker_ready_events.append(ready_event)
+
+    logging.info(f"Started {count} ingestion workers")
+
+
+def get_ingestion_readiness() -> Dict:
+    """Report whether every ingestion worker is alive with its OCR models loaded."""
+    if _lock_file is None:
+        # Another web process runs the workers and reports on them
+        return {"ready": True, "workers": [], "workers_in_other_process": True}
+    workers = [
+        {
+            "name": process.name,
+            "pid": getattr(process, "pid", os.getpid()),
+            "alive": process.is_alive(),
+            "models_loaded": ready_event.is_set(),
+        }
+        for process, ready_event in zip(_worker_processes, _worker_ready_events)
+    ]
+    return {
+        "ready": bool(workers) and all(w["alive"] and w["models_loaded"] for w in workers),
+        "workers": workers,
+    }
+
+
+def stop_ingestion_workers():
+    # In-process job loops finish their current job; it is requeued on restart if that takes too long
+    _stop_event.set()
+    for process in _worker_processes:
+        if isinstance(process, multiprocessing.process.BaseProcess) and process.is_alive():
+            process.terminate()
+    for process in _worker_processes:
+        process.join(timeout=10)
+    _worker_processes.clear()
+    _worker_ready_events.clear()
+    logging.info("Stopped ingestion workers")
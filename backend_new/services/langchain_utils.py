@@ -3,7 +3,8 @@ from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from typing import List, Dict
+from typing import Any, List, Dict
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.documents import Document
 from langchain_ollama import OllamaEmbeddings,ChatOllama
 from langchain.retrievers.multi_query import MultiQueryRetriever
@@ -11,6 +12,11 @@ from uuid import uuid4
 
 import os
 from services.vector_store_db import get_vectorstore
+from services.database import search_chunks, get_corpus_version
+from services.mmr import mmr_select
+from services.query_cache import normalize_query, query_embedding_cache, retrieval_cache
+from langchain_core.retrievers import BaseRetriever
+from services.tokens import count_tokens
 from dotenv import load_dotenv
 import logging
 from langchain.chains import ConversationalRetrievalChain
@@ -28,14 +34,18 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 print("OPENAI_API_KEY: inside the langchain",OPENAI_API_KEY)
 
-retriever = get_vectorstore().as_retriever(
-    search_type="similarity",
-    search_kwargs={
-        "k": 3,  # Number of documents to retrieve
-        "fetch_k": 4,  # Fetch more documents than k for better diversity
-        "filter": None,  # Will be set per user in the chain
-    }
-)
+# Token budget for the retrieved chunks stuffed into the answer prompt
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+# Chunks handed to the answer prompt, and candidates taken from each of the keyword and vector searches
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+# Reciprocal rank fusion constant; larger values flatten the advantage of the top ranks
+RRF_K = 60
+# Relevance against diversity when narrowing candidates to the final chunks: 1 ignores overlap, 0 ignores the query
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.5"))
+
+# Keyword searches run here while the request thread does the vector search
+_keyword_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="keyword-search")
 
 output_parser = StrOutputParser()
 
@@ -72,30 +82,104 @@ qa_prompt = ChatPromptTemplate.from_messages([
     ("human", "{input}")
 ])
 
-def get_source_chunks(query: str, k: int = 4) -> List[Document]:
-    """Get relevant chunks from the vector store."""
+def embed_question(vectorstore, question: str) -> List[float]:
+    """Embed a question with the vectorstore's model, reusing the vector of an equivalent question asked before."""
+    embedding_key = (getattr(vectorstore.embeddings, "model", None), normalize_query(question))
+    query_vector = query_embedding_cache.get(embedding_key)
+    if query_vector is None:
+        query_vector = vectorstore.embeddings.embed_query(question)
+        query_embedding_cache.put(embedding_key, query_vector)
+    return query_vector
+
+def hybrid_search(vectorstore, user_id: int, query: str, k: int = RETRIEVAL_K,
+                  fetch_k: int = RETRIEVAL_FETCH_K, lambda_mult: float = RETRIEVAL_MMR_LAMBDA) -> List[Document]:
+    """Search the user's chunks by BM25 keywords and by vector similarity at once, fuse the rankings and diversify.
+
+    Keywords catch exact part numbers, error codes and rare names that embeddings blur; vectors catch paraphrases.
+    The two rankings are merged with reciprocal rank fusion, so neither's score scale has to be calibrated, and
+    the top fetch_k of the merged list are narrowed to k by maximal marginal relevance, so overlapping chunks
+    don't take up the context twice.
+    """
+    # Repeated questions skip both searches until the user's documents change
+    normalized = normalize_query(query)
+    cache_key = (user_id, get_corpus_version(user_id), normalized, k, fetch_k, lambda_mult)
+    cached = retrieval_cache.get(cache_key)
+    if cached is not None:
+        return [Document(id=vector_id, page_content=text, metadata=dict(metadata)) for vector_id, text, metadata in cached]
+
+    keyword_future = _keyword_pool.submit(search_chunks, user_id, query, fetch_k)
+    collection = vectorstore._collection
+    query_vector = embed_question(vectorstore, query)
+    vector_hits = collection.query(
+        query_embeddings=[query_vector],
+        n_results=fetch_k,
+        include=["documents", "metadatas", "embeddings"]
+    )
     try:
-        vectorstore = get_vectorstore()
-        
-        # Get relevant documents with their scores
-        docs_and_scores = vectorstore.similarity_search_with_score(
-            query,
-            k=k * 2,  # Get more docs initially to filter
-            search_kwargs={
-                "k": k * 2,
-                "fetch_k": k * 4,  # Fetch more for better diversity
-            }
-        )
-        
+        keyword_hits = keyword_future.result()
+    except Exception as e:
+        # Vector results alone are still an answer
+        logging.error(f"Error in keyword search: {str(e)}")
+        keyword_hits = []
+
+    candidates = {}
+    vector_ids = vector_hits["ids"][0]
+    for vector_id, text, metadata, embedding in zip(vector_ids, vector_hits["documents"][0],
+                                                    vector_hits["metadatas"][0], vector_hits["embeddings"][0]):
+        candidates[vector_id] = (text, metadata, embedding)
+    keyword_ids = [hit["vector_id"] for hit in keyword_hits]
+
+    scores = {}
+    for ranking in (keyword_ids, vector_ids):
+        for rank, vector_id in enumerate(ranking):
+            scores[vector_id] = scores.get(vector_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:fetch_k]
+
+    # Keyword-only hits still need their vectors to be compared with the rest
+    missing = [vector_id for vector_id in ranked if vector_id not in candidates]
+    if missing:
+        stored = collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+        for vector_id, text, metadata, embedding in zip(stored["ids"], stored["documents"],
+                                                        stored["metadatas"], stored["embeddings"]):
+            candidates[vector_id] = (text, metadata, embedding)
+        # Dropped from the collection since it was indexed for keywords
+        ranked = [vector_id for vector_id in ranked if vector_id in candidates]
+    if not ranked:
+        retrieval_cache.put(cache_key, [])
+        return []
+
+    # Fused scores are relevance, scaled so the best is 1 like a cosine similarity
+    relevance = [scores[vector_id] / scores[ranked[0]] for vector_id in ranked]
+    picked = mmr_select([candidates[vector_id][2] for vector_id in ranked], relevance, k, lambda_mult)
+    logging.info(f"Hybrid search fused {len(keyword_ids)} keyword and {len(vector_ids)} vector hits, picked {len(picked)}")
+    results = [(ranked[i], candidates[ranked[i]][0], candidates[ranked[i]][1]) for i in picked]
+    retrieval_cache.put(cache_key, results)
+    return [Document(id=vector_id, page_content=text, metadata=dict(metadata)) for vector_id, text, metadata in results]
+
+class HybridRetriever(BaseRetriever):
+    """Retriever over one user's chunks that combines keyword and vector search."""
+
+    vectorstore: Any
+    user_id: int
+    k: int = RETRIEVAL_K
+    fetch_k: int = RETRIEVAL_FETCH_K
+    lambda_mult: float = RETRIEVAL_MMR_LAMBDA
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return hybrid_search(self.vectorstore, self.user_id, query, k=self.k, fetch_k=self.fetch_k,
+                             lambda_mult=self.lambda_mult)
+
+def get_source_chunks(query: str, user_id: int, k: int = RETRIEVAL_K) -> List[Document]:
+    """Get relevant chunks from the user's own documents."""
+    try:
+        vectorstore = get_vectorstore(user_id)
+        documents = hybrid_search(vectorstore, user_id, query, k=k)
+
         # Log the retrieved documents for debugging
         logging.info(f"Query: {query}")
-        for doc, score in docs_and_scores:
-            logging.info(f"Retrieved document with score {score}:")
+        for doc in documents:
             logging.info(f"Content: {doc.page_content}")
             logging.info(f"Metadata: {doc.metadata}")
-
-        # Filter and sort documents
-        documents = [doc for doc, _ in docs_and_scores][:k]
         
         if not documents:
             logging.warning(f"No relevant documents found for query: {query}")
@@ -109,17 +193,33 @@ def get_source_chunks(query: str, k: int = 4) -> List[Document]:
         logging.error("Full error details:", exc_info=True)
         return []
 
-def get_rag_chain(model_name: str = "gpt-4"):
-    """Create a RAG chain with the specified model."""
+class TokenBudgetRetrievalChain(ConversationalRetrievalChain):
+    """Packs retrieved chunks into max_tokens_limit using their stored token counts instead of re-tokenizing them."""
+
+    def _reduce_tokens_below_limit(self, docs: List[Document]) -> List[Document]:
+        if not self.max_tokens_limit:
+            return docs
+        packed = []
+        total = 0
+        for doc in docs:
+            # Vectors indexed before token counts were stored are counted here
+            tokens = doc.metadata.get("token_count") or count_tokens(doc.page_content)
+            if total + tokens > self.max_tokens_limit:
+                break
+            packed.append(doc)
+            total += tokens
+        if len(packed) < len(docs):
+            logging.info(f"Context budget of {self.max_tokens_limit} tokens kept {len(packed)} of {len(docs)} chunks")
+        return packed
+
+def get_rag_chain(user_id: int, model_name: str = "gpt-4"):
+    """Create a RAG chain with the specified model, retrieving only from the user's own documents."""
     try:
-        # Get the singleton vectorstore instance
-        vectorstore = get_vectorstore()
+        # Each user's documents live in their own collection
+        vectorstore = get_vectorstore(user_id)
         
         # Create retriever
-        retriever = vectorstore.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 4}
-        )
+        retriever = HybridRetriever(vectorstore=vectorstore, user_id=user_id)
         
         llm_instance = ChatOpenAI(model_name=model_name)
         
@@ -153,12 +253,13 @@ def get_rag_chain(model_name: str = "gpt-4"):
         )
         
         # Create chain
-        chain = ConversationalRetrievalChain.from_llm(
+        chain = TokenBudgetRetrievalChain.from_llm(
             llm=llm_instance,
             retriever=retriever,
             memory=memory,
             combine_docs_chain_kwargs={"prompt": prompt},
             return_source_documents=True,
+            max_tokens_limit=CONTEXT_MAX_TOKENS,
             verbose=True
         )
         
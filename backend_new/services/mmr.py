@@ -0,0 +1,36 @@
+from typing import List
+
+import numpy as np
+
+
+def mmr_select(vectors, relevance, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """Pick k candidates by maximal marginal relevance, returning their indexes in the order picked.
+
+    vectors is the (n, d) matrix of candidate embeddings and relevance their scores for the query, higher is
+    better. Each pick maximizes lambda_mult * relevance - (1 - lambda_mult) * its highest cosine similarity
+    to the candidates already picked; lambda_mult=1 is plain ranking by relevance.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    # All pairwise similarities in one product; the candidate set is small enough (tens) to hold it
+    similarity = vectors @ vectors.T
+
+    # Highest similarity of each candidate to anything picked so far
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    picked = [int(np.argmax(relevance))]
+    for _ in range(k - 1):
+        last = picked[-1]
+        available[last] = False
+        np.maximum(redundancy, similarity[last], out=redundancy)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        picked.append(int(np.argmax(scores)))
+    return picked
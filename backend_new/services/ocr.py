@@ -0,0 +1,286 @@
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from importlib import metadata
+from typing import Callable, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from docling.datamodel.base_models import InputFormat
+from docling.datamodel.pipeline_options import PdfPipelineOptions, EasyOcrOptions
+from docling.document_converter import DocumentConverter, PdfFormatOption
+
+OCR_LANGUAGES = ["en", "de", "es", "fr"]
+
+# Number of OCR worker processes; each keeps its own warm DocumentConverter
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+# Smallest page range worth shipping to a worker process
+OCR_MIN_PAGES_PER_RANGE = int(os.getenv("OCR_MIN_PAGES_PER_RANGE", "4"))
+# More ranges than workers, so one slow range doesn't leave the rest of the pool idle at the end
+OCR_RANGES_PER_WORKER = int(os.getenv("OCR_RANGES_PER_WORKER", "2"))
+
+# A page's own text layer is used instead of OCR when it has at least this many characters...
+NATIVE_TEXT_MIN_CHARS = int(os.getenv("NATIVE_TEXT_MIN_CHARS", "100"))
+# ...at most this share of them are undecodable glyphs (fonts without a unicode map)...
+NATIVE_TEXT_MAX_BAD_GLYPHS = float(os.getenv("NATIVE_TEXT_MAX_BAD_GLYPHS", "0.05"))
+# ...and images cover less of the page than this, unless the text layer itself spans the page
+NATIVE_TEXT_MAX_IMAGE_COVERAGE = float(os.getenv("NATIVE_TEXT_MAX_IMAGE_COVERAGE", "0.5"))
+NATIVE_TEXT_MIN_TEXT_COVERAGE = float(os.getenv("NATIVE_TEXT_MIN_TEXT_COVERAGE", "0.3"))
+
+# Pages are rendered at this resolution to key the OCR cache; enough to tell any edited page apart
+OCR_CACHE_RENDER_DPI = int(os.getenv("OCR_CACHE_RENDER_DPI", "72"))
+
+# Per-process converter, built by the pool initializer (or lazily in the calling process)
+_converter = None
+
+# Serializes conversions in the calling process when there is no pool, since jobs may run on several threads
+_converter_lock = threading.Lock()
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+
+def _build_converter() -> DocumentConverter:
+    # Set up Docling OCR pipeline
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = True
+    pipeline_options.ocr_options = EasyOcrOptions()
+    pipeline_options.ocr_options.lang = OCR_LANGUAGES
+
+    return DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+        }
+    )
+
+
+def get_converter() -> DocumentConverter:
+    """Get this process's DocumentConverter, building it and loading its models on first use."""
+    global _converter
+    if _converter is None:
+        converter = _build_converter()
+        # Load the layout and EasyOCR models now rather than inside the first convert()
+        converter.initialize_pipeline(InputFormat.PDF)
+        _converter = converter
+    return _converter
+
+
+def _init_ocr_worker():
+    get_converter()
+    logging.info(f"OCR worker {os.getpid()} ready")
+
+
+def _warm_ocr_worker() -> int:
+    # The initializer has already loaded the models by the time this runs
+    return os.getpid()
+
+
+def warm_up_ocr():
+    """Load the OCR models in every process that will run conversions for this one."""
+    started = time.monotonic()
+    if OCR_WORKERS <= 1:
+        get_converter()
+    else:
+        # Workers are busy in the initializer loading models, so each submit starts another process
+        pool = get_ocr_pool()
+        futures = [pool.submit(_warm_ocr_worker) for _ in range(OCR_WORKERS)]
+        pids = {future.result() for future in futures}
+        logging.info(f"Warmed {len(pids)} OCR workers")
+    logging.info(f"OCR models loaded in {time.monotonic() - started:.1f}s")
+
+
+def _layout_blocks(document, page_no: int) -> List[Dict]:
+    """Text items Docling placed on page_no, with top-left-origin bounding boxes in PDF points."""
+    page = document.pages.get(page_no)
+    if page is None:
+        return []
+    blocks = []
+    for item, _ in document.iterate_items(page_no=page_no):
+        text = getattr(item, "text", None)
+        if not text or not text.strip():
+            continue
+        for prov in item.prov:
+            if prov.page_no != page_no:
+                continue
+            bbox = prov.bbox.to_top_left_origin(page_height=page.size.height)
+            blocks.append({"text": text.strip(), "x1": bbox.l, "y1": bbox.t, "x2": bbox.r, "y2": bbox.b})
+    return blocks
+
+
+def convert_page_range(index: int, range_file: str, page_count: int) -> Tuple[int, List[Dict]]:
+    """Convert one split page-range PDF to per-page {"markdown", "blocks"}. Runs inside an OCR worker."""
+    document = get_converter().convert(range_file).document
+    return index, [
+        {
+            "markdown": document.export_to_markdown(page_no=page_no),
+            "blocks": _layout_blocks(document, page_no),
+        }
+        for page_no in range(1, page_count + 1)
+    ]
+
+
+def ocr_config_fingerprint() -> str:
+    """Identify everything besides the page image that shapes OCR output, so cache entries can't go stale."""
+    try:
+        docling_version = metadata.version("docling")
+    except metadata.PackageNotFoundError:
+        docling_version = "unknown"
+    config = {
+        "engine": "easyocr",
+        "lang": OCR_LANGUAGES,
+        "docling": docling_version,
+        "export": "markdown",
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def page_cache_keys(pdf_path: str, page_indices: List[int]) -> Dict[int, str]:
+    """Key each page by a hash of its rendered pixels plus the OCR configuration."""
+    fingerprint = ocr_config_fingerprint().encode("utf-8")
+    keys = {}
+    with fitz.open(pdf_path) as doc:
+        for page_index in page_indices:
+            pixmap = doc[page_index].get_pixmap(dpi=OCR_CACHE_RENDER_DPI, colorspace=fitz.csGRAY)
+            digest = hashlib.sha256(fingerprint)
+            digest.update(f"{pixmap.width}x{pixmap.height}".encode("utf-8"))
+            digest.update(pixmap.samples)
+            keys[page_index] = digest.hexdigest()
+    return keys
+
+
+def _covered_fraction(rects: List[fitz.Rect], page_rect: fitz.Rect) -> float:
+    page_area = page_rect.width * page_rect.height
+    if page_area <= 0:
+        return 0.0
+    area = sum((rect & page_rect).get_area() for rect in rects)
+    return min(1.0, area / page_area)
+
+
+def classify_pages(pdf_path: str) -> List[Dict]:
+    """Describe each page as {"text", "blocks", "width", "height"}.
+
+    text is the page's native text if its text layer is usable, or None if the page needs OCR;
+    blocks are then the native text blocks with top-left-origin bounding boxes in PDF points.
+    """
+    pages = []
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            page_info = {"text": None, "blocks": [], "width": page.rect.width, "height": page.rect.height}
+            pages.append(page_info)
+
+            text = page.get_text("text").strip()
+            if len(text) < NATIVE_TEXT_MIN_CHARS:
+                continue
+
+            bad_glyphs = text.count("\ufffd") / len(text)
+            blocks = page.get_text("blocks")
+            text_coverage = _covered_fraction([fitz.Rect(b[:4]) for b in blocks if b[6] == 0], page.rect)
+            image_coverage = _covered_fraction([fitz.Rect(info["bbox"]) for info in page.get_image_info()], page.rect)
+
+            usable = (
+                bad_glyphs <= NATIVE_TEXT_MAX_BAD_GLYPHS
+                and (image_coverage < NATIVE_TEXT_MAX_IMAGE_COVERAGE or text_coverage >= NATIVE_TEXT_MIN_TEXT_COVERAGE)
+            )
+            if usable:
+                page_info["text"] = text
+                page_info["blocks"] = [
+                    {"text": b[4].strip(), "x1": b[0], "y1": b[1], "x2": b[2], "y2": b[3]}
+                    for b in blocks if b[6] == 0 and b[4].strip()
+                ]
+    return pages
+
+
+def plan_page_ranges(total_pages: int, workers: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Split [0, total_pages) into contiguous (start, end) ranges sized for the OCR pool."""
+    if total_pages <= 0:
+        return []
+
+    workers = max(1, workers or OCR_WORKERS)
+    count = min(
+        total_pages,
+        workers * OCR_RANGES_PER_WORKER,
+        math.ceil(total_pages / OCR_MIN_PAGES_PER_RANGE),
+    )
+    count = max(1, count)
+
+    # Spread the remainder over the first ranges so sizes differ by at most one page
+    base, extra = divmod(total_pages, count)
+    ranges = []
+    start = 0
+    for i in range(count):
+        end = start + base + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def get_ocr_pool() -> ProcessPoolExecutor:
+    """Get or create the OCR process pool as a singleton."""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_ocr_worker,
+            )
+            logging.info(f"Started OCR pool with {OCR_WORKERS} workers")
+        return _ocr_pool
+
+
+def shutdown_ocr_pool():
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is not None:
+            _ocr_pool.shutdown(wait=False, cancel_futures=True)
+            _ocr_pool = None
+
+
+def convert_page_ranges(range_files: List[Tuple[str, int]],
+                        progress_callback: Optional[Callable[[int, int], None]] = None,
+                        result_callback: Optional[Callable[[int, List[Dict]], None]] = None) -> List[List[Dict]]:
+    """OCR the split (range_file, page_count) files in parallel and return their per-page output in order.
+
+    Each page comes back as {"markdown", "blocks"}, blocks carrying the text items' bounding boxes.
+    progress_callback, if given, is called as (completed, total) as each range finishes.
+    result_callback, if given, is called as (index, pages) with each range's output as soon as it is ready.
+    """
+    total = len(range_files)
+    markdowns = [None] * total
+
+    if OCR_WORKERS <= 1:
+        for index, (range_file, page_count) in enumerate(range_files):
+            with _converter_lock:
+                _, markdowns[index] = convert_page_range(index, range_file, page_count)
+            if result_callback is not None:
+                result_callback(index, markdowns[index])
+            if progress_callback is not None:
+                progress_callback(index + 1, total)
+        return markdowns
+
+    pool = get_ocr_pool()
+    try:
+        futures = [
+            pool.submit(convert_page_range, index, range_file, page_count)
+            for index, (range_file, page_count) in enumerate(range_files)
+        ]
+        for completed, future in enumerate(as_completed(futures), start=1):
+            index, markdown = future.result()
+            markdowns[index] = markdown
+            if result_callback is not None:
+                result_callback(index, markdown)
+            if progress_callback is not None:
+                progress_callback(completed, total)
+    except BrokenProcessPool:
+        # A worker died (usually OOM); drop the pool so the next document gets a fresh one
+        logging.error("OCR pool broke while converting page ranges")
+        shutdown_ocr_pool()
+        raise
+
+    return markdowns
@@ -0,0 +1,55 @@
+import json
+import os
+from typing import Dict, List
+
+from services.sqlite_cache import SQLiteLRUCache
+
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "ocr_cache.db")
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "512"))
+
+
+def _encode_page(page: Dict) -> tuple:
+    return page["markdown"], json.dumps(page.get("blocks") or [])
+
+
+def _decode_page(row) -> Dict:
+    return {
+        "markdown": row['markdown'],
+        "blocks": json.loads(row['blocks']) if row['blocks'] else [],
+    }
+
+
+_cache = SQLiteLRUCache(
+    OCR_CACHE_PATH, "ocr_pages", "ocr_cache_stats",
+    columns=[("markdown", "TEXT NOT NULL"), ("blocks", "TEXT")],
+    max_bytes=OCR_CACHE_MAX_MB * 1024 * 1024,
+    encode=_encode_page, decode=_decode_page, label="OCR",
+)
+
+
+def create_ocr_cache():
+    _cache.create()
+    conn = _cache.connect()
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(ocr_pages)')}
+    if 'blocks' not in columns:
+        conn.execute('ALTER TABLE ocr_pages ADD COLUMN blocks TEXT')
+    conn.commit()
+    conn.close()
+
+
+def get_cached_pages(cache_keys: List[str]) -> Dict[str, Dict]:
+    """Look up OCR output ({"markdown", "blocks"}) for the given page keys, returning only the hits."""
+    return _cache.get(cache_keys)
+
+
+def put_cached_pages(pages: Dict[str, Dict]):
+    """Store OCR output ({"markdown", "blocks"}) by page key and evict least recently used pages past the size limit."""
+    _cache.put(pages)
+
+
+def get_ocr_cache_stats() -> Dict:
+    return _cache.stats()
+
+
+# Initialize the cache tables
+create_ocr_cache()
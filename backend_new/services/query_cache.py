@@ -0,0 +1,84 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from services.embedding_cache import normalize_text
+
+# Entries per cache; a retrieval result is a handful of chunks, so a few thousand stay small
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+# Seconds an entry stays valid (0: until evicted or the user's documents change)
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "0"))
+
+
+def normalize_query(query: str) -> str:
+    """Fold case, whitespace and trailing punctuation, so trivially re-typed questions share an entry."""
+    return re.sub(r"[\s?!.]+$", "", normalize_text(query).casefold())
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with an optional time to live."""
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_size,
+                "ttl_seconds": self.ttl,
+            }
+
+
+# Query vectors by model and normalized query; they don't depend on anyone's documents
+query_embedding_cache = LRUCache()
+# Fused, diversified chunks by user, corpus version, normalized query and retrieval settings
+retrieval_cache = LRUCache()
+
+
+def get_query_cache_stats() -> Dict:
+    return {
+        "embeddings": query_embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+    }
@@ -0,0 +1,141 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+# Eviction trims a cache to this share of its limit, so it doesn't run on every insert
+CACHE_EVICT_TO = 0.9
+
+
+class SQLiteLRUCache:
+    """A key-value cache in a SQLite file, evicting least recently used entries past a size limit.
+
+    Values are stored in the given columns of table; encode turns a value into a tuple of column values and
+    decode turns a row back into a value. An entry's size is the length of its text and blob columns.
+    """
+
+    def __init__(self, path: str, table: str, stats_table: str, columns: List[Tuple[str, str]], max_bytes: int,
+                 encode: Callable[[Any], tuple], decode: Callable[[sqlite3.Row], Any], label: str):
+        self.path = path
+        self.table = table
+        self.stats_table = stats_table
+        self.columns = columns
+        self.max_bytes = max_bytes
+        self.encode = encode
+        self.decode = decode
+        self.label = label
+        # Serializes cache access from the threads of one process
+        self._lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self):
+        conn = self.connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        column_sql = ''.join(f'{name} {definition}, ' for name, definition in self.columns)
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {self.table}
+                         (cache_key TEXT PRIMARY KEY, {column_sql}size INTEGER NOT NULL, last_access REAL NOT NULL)''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_last_access ON {self.table}(last_access)')
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {self.stats_table}
+                         (name TEXT PRIMARY KEY,
+                          value INTEGER NOT NULL DEFAULT 0)''')
+        conn.commit()
+        conn.close()
+
+    def _bump_stat(self, conn, name: str, amount: int):
+        if amount:
+            conn.execute(f'''
+                INSERT INTO {self.stats_table} (name, value) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+            ''', (name, amount))
+
+    def get(self, cache_keys: List[str]) -> Dict[str, Any]:
+        """Look up the values for the given keys, returning only the hits."""
+        if not cache_keys:
+            return {}
+        columns = ', '.join(name for name, _ in self.columns)
+        try:
+            with self._lock:
+                conn = self.connect()
+                found = {}
+                # Stay well under SQLite's bound-parameter limit
+                for start in range(0, len(cache_keys), 500):
+                    batch = cache_keys[start:start + 500]
+                    placeholders = ','.join('?' for _ in batch)
+                    for row in conn.execute(f'SELECT cache_key, {columns} FROM {self.table} WHERE cache_key IN ({placeholders})', batch):
+                        found[row['cache_key']] = self.decode(row)
+
+                if found:
+                    now = time.time()
+                    conn.executemany(f'UPDATE {self.table} SET last_access = ? WHERE cache_key = ?', [(now, key) for key in found])
+                self._bump_stat(conn, 'hits', len(found))
+                self._bump_stat(conn, 'misses', len(cache_keys) - len(found))
+                conn.commit()
+                conn.close()
+                return found
+
+        except Exception as e:
+            # The cache is an optimisation; a broken cache must never fail the work it saves
+            logging.error(f"Error reading {self.label} cache: {str(e)}")
+            return {}
+
+    def put(self, values: Dict[str, Any]):
+        """Store values by key and evict least recently used entries past the size limit."""
+        if not values:
+            return
+        names = [name for name, _ in self.columns]
+        try:
+            with self._lock:
+                conn = self.connect()
+                now = time.time()
+                rows = []
+                for key, value in values.items():
+                    encoded = self.encode(value)
+                    size = sum(len(v.encode('utf-8')) if isinstance(v, str) else len(v)
+                               for v in encoded if isinstance(v, (str, bytes)))
+                    rows.append((key, *encoded, size, now))
+                conn.executemany(f'''
+                    INSERT OR REPLACE INTO {self.table} (cache_key, {', '.join(names)}, size, last_access)
+                    VALUES ({','.join('?' for _ in range(len(names) + 3))})
+                ''', rows)
+
+                total = conn.execute(f'SELECT COALESCE(SUM(size), 0) FROM {self.table}').fetchone()[0]
+                if total > self.max_bytes:
+                    evicted = 0
+                    target = self.max_bytes * CACHE_EVICT_TO
+                    for row in conn.execute(f'SELECT cache_key, size FROM {self.table} ORDER BY last_access').fetchall():
+                        if total <= target:
+                            break
+                        conn.execute(f'DELETE FROM {self.table} WHERE cache_key = ?', (row['cache_key'],))
+                        total -= row['size']
+                        evicted += 1
+                    self._bump_stat(conn, 'evictions', evicted)
+                    logging.info(f"Evicted {evicted} entries from the {self.label} cache")
+
+                conn.commit()
+                conn.close()
+
+        except Exception as e:
+            logging.error(f"Error writing {self.label} cache: {str(e)}")
+
+    def stats(self) -> Dict:
+        conn = self.connect()
+        stats = {row['name']: row['value'] for row in conn.execute(f'SELECT name, value FROM {self.stats_table}')}
+        entries, size = conn.execute(f'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}').fetchone()
+        conn.close()
+
+        hits = stats.get('hits', 0)
+        misses = stats.get('misses', 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": stats.get('evictions', 0),
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, List, Optional
+
+import openai
+import tiktoken
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+# Maximum summary requests in flight at once
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+# Account limits for the summary model; requests wait in the token buckets rather than hit 429s
+SUMMARY_RPM = int(os.getenv("SUMMARY_RPM", "500"))
+SUMMARY_TPM = int(os.getenv("SUMMARY_TPM", "200000"))
+SUMMARY_MAX_RETRIES = int(os.getenv("SUMMARY_MAX_RETRIES", "6"))
+# Completion tokens budgeted per prompt token, since summaries are asked to be half the input
+SUMMARY_COMPLETION_RATIO = 0.5
+
+
+def build_summary_prompt(text: str) -> str:
+    return (
+        "Please provide a detailed and comprehensive summary of the following text. "
+        "This should not be a brief or surface-level overview — I’m looking for a thorough, in-depth summary "
+        "that captures the key ideas, reasoning, and structure of the content. "
+        "The summary should be extensive — ideally at least half as long as the original — and should span multiple paragraphs (or even pages) if needed.\n\n"
+        "When you provide the summary, please output only the core content without any additional sections such as an introduction, conclusion, or any other extraneous blocks.\n\n"
+
+        f"{text}"
+    )
+
+
+class TokenBucket:
+    """Refilling per-minute budget. Thread-safe, so one bucket can be shared by every event loop in the process."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take amount from the bucket and return how many seconds to wait before using it."""
+        # A single request larger than the whole bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def drain(self, seconds: float):
+        """Empty the bucket so that nothing goes out for the next `seconds`."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, tokens: int):
+        delay = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def back_off(self, seconds: float):
+        # A 429 means our view of the budget is off; stop everyone, not just the caller
+        self.requests.drain(seconds)
+        self.tokens.drain(seconds)
+
+
+# Shared by every summarization in this process so concurrent documents respect the same limits
+_rate_limiter = RateLimiter(SUMMARY_RPM, SUMMARY_TPM)
+
+
+def _get_encoding():
+    try:
+        return tiktoken.encoding_for_model(SUMMARY_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after_ms = response.headers.get("retry-after-ms")
+        if retry_after_ms:
+            return float(retry_after_ms) / 1000.0
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    # Exponential backoff with jitter, capped at a minute
+    return min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+async def _summarize_one(client, semaphore: asyncio.Semaphore, encoding, text: str) -> str:
+    prompt = build_summary_prompt(text)
+    prompt_tokens = len(encoding.encode(prompt))
+    budget = int(prompt_tokens * (1 + SUMMARY_COMPLETION_RATIO))
+
+    async with semaphore:
+        for attempt in range(SUMMARY_MAX_RETRIES + 1):
+            await _rate_limiter.acquire(budget)
+            try:
+                response = await client.chat.completions.create(
+                    model=SUMMARY_MODEL,
+                    messages=[
+                        {"role": "system", "content": "You are a helpful assistant."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.5
+                )
+                return response.choices[0].message.content
+
+            except openai.RateLimitError as e:
+                if attempt == SUMMARY_MAX_RETRIES:
+                    raise
+                delay = retry_delay(e, attempt)
+                logging.warning(f"Summary request rate limited, backing off {delay:.1f}s (attempt {attempt + 1})")
+                _rate_limiter.back_off(delay)
+
+            except (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == SUMMARY_MAX_RETRIES:
+                    raise
+                delay = retry_delay(e, attempt)
+                logging.warning(f"Summary request failed ({str(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+async def summarize_sections_async(texts: List[str],
+                                   progress_callback: Optional[Callable[[int, int], None]] = None,
+                                   result_callback: Optional[Callable[[int, str], None]] = None) -> List[str]:
+    """Summarize every text concurrently and return the summaries in input order.
+
+    progress_callback, if given, is called as (completed, total) as each summary finishes.
+    result_callback, if given, is called as (index, summary) as soon as each summary is ready.
+    """
+    # Retries are handled here so they go through the shared rate limiter
+    client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    encoding = _get_encoding()
+    completed = 0
+
+    async def run(index: int, text: str) -> str:
+        nonlocal completed
+        summary = await _summarize_one(client, semaphore, encoding, text)
+        if result_callback is not None:
+            result_callback(index, summary)
+        completed += 1
+        if progress_callback is not None:
+            progress_callback(completed, len(texts))
+        return summary
+
+    try:
+        # gather keeps results in input order regardless of completion order
+        return await asyncio.gather(*(run(index, text) for index, text in enumerate(texts)))
+    finally:
+        await client.close()
+
+
+def summarize_sections(texts: List[str],
+                       progress_callback: Optional[Callable[[int, int], None]] = None,
+                       result_callback: Optional[Callable[[int, str], None]] = None) -> List[str]:
+    """Blocking wrapper around summarize_sections_async for the synchronous ingestion pipeline."""
+    return asyncio.run(summarize_sections_async(texts, progress_callback, result_callback))
@@ -0,0 +1,23 @@
+import os
+import threading
+
+import tiktoken
+
+# Encoding used to size chunks; cl100k_base is what the OpenAI embedding and chat models tokenize with
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """Get the shared tiktoken encoding, loading it on first use."""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        return _encoding
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text, disallowed_special=()))
@@ -1,7 +1,4 @@
-from typing import List, Dict
-from docling.datamodel.base_models import InputFormat
-from docling.datamodel.pipeline_options import PdfPipelineOptions, EasyOcrOptions
-from docling.document_converter import DocumentConverter, PdfFormatOption
+from typing import List, Dict, Callable, Optional, Union
 import logging
 
 # Import necessary packages
@@ -18,12 +15,9 @@ from langchain_community.document_loaders import  (
 )
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
 # from langchain_ollama import OllamaEmbeddings
 # import ollama
 
-import openai
-
 from langchain_chroma import Chroma
 from typing import List, Dict
 from langchain_core.documents import Document
@@ -36,10 +30,20 @@ import fitz  # PyMuPDF
 from langchain.document_loaders import PyMuPDFLoader
 from chromadb.config import Settings
 import chromadb
-from services.database import get_db_connection  # Add this import
+from services.database import (get_db_connection, chunk_content_hashes, delete_chunk_search, has_chunk_search,
+                               sync_chunk_search, bump_corpus_version)
+from services.ocr import classify_pages, page_cache_keys, plan_page_ranges, convert_page_ranges
+from services.ocr_cache import get_cached_pages, put_cached_pages
+from services.embedding_cache import CachedEmbeddings
+from services.faiss_store import FAISS_DIR, FaissCollection
+from services.embeddings import EMBED_BATCH_SIZE, LEGACY_EMBEDDING_MODEL_ID, embed_batches, embedding_model_id, get_embeddings
+from services.checkpoints import DocumentCheckpoint, content_key
+from services.summarization import summarize_sections
+from services.tokens import count_tokens
 import logging
 from chromadb.utils import embedding_functions
 import shutil
+import threading
 
 # Load environment variables from .env file
 load_dotenv()
@@ -52,45 +56,201 @@ LANGCHAIN_TRACING_V2 = os.getenv("LANGCHAIN_TRACING_V2")
 
 print("OPENAI_API_KEY:",OPENAI_API_KEY)
 
-# EMBEDDING_MODEL = "nomic-embed-text"
+# Chunks are sized in tokens, so embedding batches and prompt context have predictable sizes
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+
+# Initialize text splitter
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS, length_function=count_tokens)
+
+# Summaries cover this many slices of a document, however finely it was split for OCR
+SUMMARY_SECTIONS = 10
+# Chunks embedded per request are bounded by count (EMBED_BATCH_SIZE) and by their summed token counts;
+# a batch is also the unit vectors are written to Chroma in
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "100000"))
+
+# "chroma", or "faiss" for memory-mapped indexes on disk that all workers of a node share (see services/faiss_store.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+# Each user's vectors live in their own collection, named after this prefix; the bare name is the
+# pre-partitioning global collection, drained into the per-user ones. Use a new prefix when switching embedding models.
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "documents")
+# A Chroma server every process talks to. Without one, Chroma runs embedded in the web process, which must then
+# be the only process that touches ./chroma_db: embedded Chroma isn't safe across processes
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+# Bound on the HNSW indexes Chroma keeps loaded; least recently used users' collections are unloaded past it
+CHROMA_MEMORY_LIMIT_MB = int(os.getenv("CHROMA_MEMORY_LIMIT_MB", "0"))
+# Vectors moved per round trip when draining the global collection
+LEGACY_MIGRATION_BATCH = 1000
+
+# A single, shared client and embedding model, and one vectorstore per user on top of them
+_client = None
+_embeddings = None
+_model_id = None
+_vectorstores: Dict[int, Chroma] = {}
+_vectorstore_lock = threading.Lock()
+
+class FaissVectorStore:
+    """A user's FAISS collection and the embedding model, in the shape the rest of the app uses a Chroma store."""
+
+    def __init__(self, collection: FaissCollection, embeddings):
+        self._collection = collection
+        self.embeddings = embeddings
+
+def _check_collection_model(client, name: str, model_id: str):
+    """Refuse to open a collection whose vectors came from a different embedding model than model_id."""
+    try:
+        collection = client.get_collection(name)
+    except Exception:
+        # Created on first use, with model_id recorded
+        return
+    _check_model_metadata(collection, name, model_id)
+
+def _check_model_metadata(collection, name: str, model_id: str):
+    metadata = dict(collection.metadata or {})
+    recorded = metadata.get("embedding_model")
+    if recorded is None:
+        # Collections from before the model was recorded were all embedded with OpenAI's default model
+        recorded = model_id if collection.count() == 0 else LEGACY_EMBEDDING_MODEL_ID
+        # Chroma won't modify metadata that carries index settings, even unchanged ones
+        if not any(key.startswith("hnsw:") for key in metadata):
+            collection.modify(metadata={**metadata, "embedding_model": recorded})
+            logging.info(f"Recorded embedding model {recorded} for collection {name}")
+
+    if recorded != model_id:
+        raise RuntimeError(
+            f"Collection {name} holds vectors from {recorded} but the configured embedding model is {model_id}; "
+            f"set CHROMA_COLLECTION to a new prefix and re-index, or switch the model back"
+        )
 
+def _get_chroma_client():
+    """The shared Chroma client: the server at CHROMA_HOST, or embedded Chroma over ./chroma_db."""
+    if _client is not None:
+        return _client
+    if CHROMA_HOST:
+        return chromadb.HttpClient(
+            host=CHROMA_HOST,
+            port=CHROMA_PORT,
+            settings=chromadb.Settings(anonymized_telemetry=False)
+        )
+    settings = {"anonymized_telemetry": False, "is_persistent": True}
+    if CHROMA_MEMORY_LIMIT_MB:
+        settings.update(
+            chroma_segment_cache_policy="LRU",
+            chroma_memory_limit_bytes=CHROMA_MEMORY_LIMIT_MB * 1024 * 1024
+        )
+    # Initialize Chroma client with consistent settings
+    return chromadb.PersistentClient(
+        path="./chroma_db",
+        settings=chromadb.Settings(**settings)
+    )
 
-# Initialize text splitter and embedding function
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
-embedding_function = OpenAIEmbeddings()
-# embedding_function = OllamaEmbeddings(model=EMBEDDING_MODEL)
+def vector_writes_need_one_process() -> bool:
+    """Whether only the web process may write vectors, because the store is embedded Chroma."""
+    return VECTOR_BACKEND == "chroma" and not CHROMA_HOST
 
-# Initialize a single, shared instance of the vectorstore
-_vectorstore = None
+def user_collection_name(user_id: int) -> str:
+    return f"{CHROMA_COLLECTION}_user_{user_id}"
 
-def get_vectorstore():
-    """Get or create the vectorstore as a singleton."""
-    global _vectorstore
+def _migrate_legacy_vectors(client, collection, user_id: int):
+    """Move user_id's vectors out of the global collection into their own."""
+    try:
+        legacy = client.get_collection(CHROMA_COLLECTION)
+    except Exception:
+        return
+    try:
+        _check_collection_model(client, CHROMA_COLLECTION, _model_id)
+    except RuntimeError as e:
+        logging.warning(f"Not migrating vectors of user {user_id}: {str(e)}")
+        return
+
+    moved = 0
+    while True:
+        batch = legacy.get(
+            where={"user_id": user_id},
+            limit=LEGACY_MIGRATION_BATCH,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        if not batch["ids"]:
+            break
+        # Copy before deleting, so an interrupted migration just picks up again next time
+        collection.upsert(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"]
+        )
+        legacy.delete(ids=batch["ids"])
+        moved += len(batch["ids"])
+    if moved:
+        logging.info(f"Moved {moved} vectors of user {user_id} from {CHROMA_COLLECTION} to {collection.name}")
+
+def _backfill_chunk_search(collection, user_id: int):
+    """Fill the lexical index from vectors stored before it existed."""
+    if has_chunk_search(user_id) or collection.count() == 0:
+        return
+    files = {}
+    offset = 0
+    while True:
+        batch = collection.get(limit=LEGACY_MIGRATION_BATCH, offset=offset, include=["documents", "metadatas"])
+        if not batch["ids"]:
+            break
+        for vector_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+            entries = files.setdefault(metadata.get("file_id"), ([], [], []))
+            entries[0].append(vector_id)
+            entries[1].append(text or "")
+            entries[2].append(metadata)
+        offset += len(batch["ids"])
+    for file_id, (ids, texts, metadatas) in files.items():
+        sync_chunk_search(file_id, user_id, ids, texts, metadatas)
+    bump_corpus_version(user_id)
+    logging.info(f"Added {offset} chunks of user {user_id} to the lexical index")
+
+def get_vectorstore(user_id: int):
+    """Get the vectorstore over user_id's own collection, so their searches never touch other users' vectors."""
+    global _client, _embeddings, _model_id
     
     try:
-        if _vectorstore is not None:
-            return _vectorstore
+        vectorstore = _vectorstores.get(user_id)
+        if vectorstore is not None:
+            return vectorstore
             
-        # Initialize embeddings
-        embeddings = OpenAIEmbeddings()
-        
-        # Initialize Chroma client with consistent settings
-        client = chromadb.PersistentClient(
-            path="./chroma_db",
-            settings=chromadb.Settings(
-                anonymized_telemetry=False,
-                is_persistent=True
+        # Ingestion jobs run on several threads; only one of them may build the client
+        with _vectorstore_lock:
+            if user_id in _vectorstores:
+                return _vectorstores[user_id]
+
+            if _embeddings is None:
+                # Initialize the configured embedding model; repeated chunks and questions are served from the local cache
+                _model_id = embedding_model_id()
+                _embeddings = CachedEmbeddings(get_embeddings(), model=_model_id)
+
+            name = user_collection_name(user_id)
+            if VECTOR_BACKEND == "faiss":
+                collection = FaissCollection(name)
+                _check_model_metadata(collection, name, _model_id)
+                vectorstore = FaissVectorStore(collection, _embeddings)
+                _backfill_chunk_search(collection, user_id)
+                _vectorstores[user_id] = vectorstore
+                return vectorstore
+
+            _client = _get_chroma_client()
+
+            # The collection records the model its vectors came from, so a changed model can't mix into it
+            _check_collection_model(_client, name, _model_id)
+
+            # Create vectorstore
+            vectorstore = Chroma(
+                client=_client,
+                collection_name=name,
+                embedding_function=_embeddings,
+                collection_metadata={"embedding_model": _model_id}
             )
-        )
-        
-        # Create vectorstore
-        _vectorstore = Chroma(
-            client=client,
-            collection_name="documents",
-            embedding_function=embeddings
-        )
-        
-        return _vectorstore
+            _migrate_legacy_vectors(_client, vectorstore._collection, user_id)
+            _backfill_chunk_search(vectorstore._collection, user_id)
+
+            _vectorstores[user_id] = vectorstore
+            return vectorstore
         
     except Exception as e:
         logging.error(f"Error initializing vectorstore: {str(e)}")
@@ -115,19 +275,142 @@ def load_and_split_document(file_path: str) -> List[Document]:
         raise ValueError(f"Unsupported file type: {file_path}")
 
     documents = loader.load()
-    return text_splitter.split_documents(documents)
-
-
-
+    return split_with_token_counts(documents)
+
+
+
+
+def split_with_token_counts(documents: List[Document]) -> List[Document]:
+    """Split documents with text_splitter and record each chunk's token count in its metadata."""
+    splits = text_splitter.split_documents(documents)
+    for split in splits:
+        split.metadata['token_count'] = count_tokens(split.page_content)
+    return splits
+
+
+def _token_batches(token_counts: List[int], max_items: int, max_tokens: int) -> List[tuple]:
+    """Cut [0, len(token_counts)) into (start, end) batches within max_items and max_tokens."""
+    batches = []
+    start = 0
+    tokens = 0
+    for i, count in enumerate(token_counts):
+        if i > start and (i - start >= max_items or tokens + count > max_tokens):
+            batches.append((start, i))
+            start = i
+            tokens = 0
+        tokens += count
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+def _vector_ids(file_id: int, texts: List[str], metadatas: List[Dict]) -> List[str]:
+    """Derive vector ids from the document and each chunk's text, so unchanged text keeps its id across re-indexes.
+
+    Layout chunks and other splits (summaries, loader output) are numbered separately, which gives a layout
+    chunk the same content hash as its document_chunks row.
+    """
+    ids = [None] * len(texts)
+    for kind, layout in (("chunk", True), ("text", False)):
+        positions = [i for i, metadata in enumerate(metadatas) if ("chunk_id" in metadata) == layout]
+        for i, content_hash in zip(positions, chunk_content_hashes([texts[i] for i in positions])):
+            ids[i] = f"{file_id}:{kind}:{content_hash}"
+    return ids
+
+
+def _sync_document_vectors(vectorstore, file_id: int, user_id: int, ids: List[str], texts: List[str],
+                           metadatas: List[Dict], token_counts: List[int],
+                           vectors: Optional[List[List[float]]] = None,
+                           progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict[str, int]:
+    """Make file_id's vectors exactly ids, embedding only the ones not stored yet.
+
+    New entries are embedded in token-bounded batches, EMBED_CONCURRENCY requests at a time, and each batch is
+    written as soon as it finishes; given vectors are used instead of embedding. Stale vectors are deleted only
+    once everything new is in, so the document never drops out of the index, and a rerun after a failure
+    carries on where it stopped, since batches already written are no longer new.
+    progress_callback, if given, is called as (completed, total) as each batch is written.
+    """
+    collection = vectorstore._collection
+    where_clause = {"$and": [{"file_id": file_id}, {"user_id": user_id}]}
+    stored = set(collection.get(where=where_clause, include=[])["ids"])
+    new = [i for i, vector_id in enumerate(ids) if vector_id not in stored]
+    kept = [i for i, vector_id in enumerate(ids) if vector_id in stored]
+    # Includes vectors stored under random ids before chunks were hashed
+    removed = list(stored - set(ids))
+
+    batches = [
+        new[start:end]
+        for start, end in _token_batches([token_counts[i] for i in new], EMBED_BATCH_SIZE, EMBED_BATCH_TOKENS)
+    ]
+    written = 0
+
+    def write_batch(index: int, batch_vectors: List[List[float]]):
+        nonlocal written
+        positions = batches[index]
+        collection.upsert(
+            ids=[ids[i] for i in positions],
+            embeddings=batch_vectors,
+            documents=[texts[i] for i in positions],
+            metadatas=[metadatas[i] for i in positions]
+        )
+        written += 1
+        logging.info(f"Wrote {written} of {len(batches)} embedding batches for document {file_id}")
+        if progress_callback is not None:
+            progress_callback(written, len(batches))
 
-def index_document_to_chroma(file_path: str, file_id: int,user_id:int) -> bool:
-    """Index document chunks to ChromaDB with batching."""
+    if vectors is None:
+        embed_batches(vectorstore.embeddings, [[texts[i] for i in positions] for positions in batches], write_batch)
+    else:
+        for index, positions in enumerate(batches):
+            write_batch(index, [vectors[i] for i in positions])
+    # FAISS collections buffer writes until flushed; Chroma writes through
+    if hasattr(collection, "flush"):
+        collection.flush()
+
+    if kept:
+        # Same text, same embedding; only metadata such as the page or chunk row can have changed
+        collection.update(ids=[ids[i] for i in kept], metadatas=[metadatas[i] for i in kept])
+    if removed:
+        collection.delete(ids=removed)
+    # Hybrid retrieval searches the same chunks by keyword
+    sync_chunk_search(file_id, user_id, ids, texts, metadatas)
+    # Cached retrieval results for this user no longer match their documents
+    bump_corpus_version(user_id)
+
+    return {"added": len(new), "kept": len(kept), "removed": len(removed)}
+
+
+def index_document_to_chroma(file_path: str, file_id: int,user_id:int, text: Optional[Union[str, List[str]]] = None,
+                             chunks: Optional[List[Dict]] = None,
+                             progress_callback: Optional[Callable[[int, int], None]] = None) -> Optional[Dict[str, int]]:
+    """Index document chunks to ChromaDB, embedding only chunks the document doesn't already have.
+
+    When text is given it is split and indexed directly, and file_path is only recorded as the source.
+    A list of texts is split one by one, so an edit to one section doesn't shift the splits of the others.
+    chunks are stored layout chunks (with their document_chunks chunk_id) to index alongside it.
+    progress_callback, if given, is called as (completed, total) as each embedding batch is written.
+    Returns the {"added", "kept", "removed"} vector counts, or None if indexing failed.
+    """
     try:
-        
-        file_path = "temp_final_summary.txt"
-
-        
-        splits = load_and_split_document(file_path)
+        if text is not None:
+            sections = [text] if isinstance(text, str) else text
+            splits = split_with_token_counts([
+                Document(page_content=section, metadata={"source": file_path}) for section in sections
+            ])
+        else:
+            splits = load_and_split_document(file_path)
+
+        # Layout chunks link back to their document_chunks row, which holds the page and bounding box
+        for chunk in chunks or []:
+            splits.append(Document(
+                page_content=chunk["chunk_text"],
+                metadata={
+                    "source": file_path,
+                    "chunk_id": chunk["chunk_id"],
+                    "page_number": chunk["page_number"],
+                    "token_count": chunk["token_count"],
+                }
+            ))
 
         # Add metadata to each split
         for split in splits:
@@ -137,54 +420,37 @@ def index_document_to_chroma(file_path: str, file_id: int,user_id:int) -> bool:
             
         logging.info(f"Indexing document {file_id} to ChromaDB")
         
-        # vectorstore = get_vectorstore()
-        
-        # Process in batches of 5000 chunks
-        BATCH_SIZE = 5000
-        # total_chunks = len(chunks)
-        
-        # for i in range(0, total_chunks, BATCH_SIZE):
-        #     batch = chunks[i:i + BATCH_SIZE]
-        #     logging.info(f"Processing batch {i//BATCH_SIZE + 1} of {(total_chunks + BATCH_SIZE - 1)//BATCH_SIZE}")
-            
-        #     # Prepare batch data
-        #     texts = []
-        #     metadatas = []
-            
-        #     for chunk in batch:
-        #         texts.append(chunk['chunk_text'])
-        #         metadatas.append({
-        #             "file_id": file_id,
-        #             "chunk_id": chunk["chunk_id"],
-        #             "source_file": chunk["source_file"]
-        #         })
-            
-            # Add batch to vectorstore
-        _vectorstore.add_documents(splits)
+        # Ingestion workers run in their own processes, so the store may not exist yet
+        vectorstore = get_vectorstore(user_id)
 
-        # vectorstore.add_texts(
-        #     texts=texts,
-        #     metadatas=metadatas
-        # )
-            
+        texts = [split.page_content for split in splits]
+        metadatas = [split.metadata for split in splits]
+        token_counts = [split.metadata['token_count'] for split in splits]
+
+        stats = _sync_document_vectors(
+            vectorstore, file_id, user_id, _vector_ids(file_id, texts, metadatas), texts, metadatas, token_counts,
+            progress_callback=progress_callback
+        )
         
-        logging.info(f"Successfully indexed all  chunks for document {file_id}")
-        return True
+        logging.info(f"Successfully indexed document {file_id}: {stats}")
+        return stats
         
     except Exception as e:
         logging.error(f"Error indexing document to ChromaDB: {str(e)}")
-        return False
+        return None
 
 def delete_doc_from_chroma(file_id: int, user_id: int):
     try:
         # Get the vectorstore instance
-        vectorstore = get_vectorstore()
+        vectorstore = get_vectorstore(user_id)
         
         # Fix the logical operator in the where clause
         where_clause = {"$and": [{"file_id": file_id}, {"user_id": user_id}]}
         
         # Delete documents from Chroma
         vectorstore._collection.delete(where=where_clause)
+        delete_chunk_search(file_id, user_id)
+        bump_corpus_version(user_id)
         logging.info(f"Deleted all documents with file_id {file_id}")
         
         return True
@@ -194,6 +460,47 @@ def delete_doc_from_chroma(file_id: int, user_id: int):
         logging.error("Full error details:", exc_info=True)
         return False
 
+def copy_doc_in_chroma(source_file_id: int, source_user_id: int, file_id: int, user_id: int,
+                       chunk_id_map: Optional[Dict[int, int]] = None) -> Optional[Dict[str, int]]:
+    """Give file_id copies of another document's chunks, reusing their stored embeddings.
+
+    chunk_id_map re-points copied layout chunks at file_id's own document_chunks rows.
+    Vectors file_id already had that aren't in the source are removed.
+    Returns the {"added", "kept", "removed"} vector counts, or None if there was nothing to copy.
+    """
+    try:
+        vectorstore = get_vectorstore(user_id)
+
+        where_clause = {"$and": [{"file_id": source_file_id}, {"user_id": source_user_id}]}
+        existing = get_vectorstore(source_user_id)._collection.get(
+            where=where_clause,
+            include=["embeddings", "documents", "metadatas"]
+        )
+
+        if not existing["ids"]:
+            logging.warning(f"No chunks found in Chroma for source file_id {source_file_id}")
+            return None
+
+        metadatas = [
+            {**metadata, "file_id": file_id, "user_id": user_id}
+            for metadata in existing["metadatas"]
+        ]
+        for metadata in metadatas:
+            if chunk_id_map and metadata.get("chunk_id") in chunk_id_map:
+                metadata["chunk_id"] = chunk_id_map[metadata["chunk_id"]]
+        texts = existing["documents"]
+        stats = _sync_document_vectors(
+            vectorstore, file_id, user_id, _vector_ids(file_id, texts, metadatas), texts, metadatas,
+            [metadata.get("token_count", 0) for metadata in metadatas], vectors=existing["embeddings"]
+        )
+
+        logging.info(f"Copied chunks from file_id {source_file_id} to file_id {file_id}: {stats}")
+        return stats
+
+    except Exception as e:
+        logging.error(f"Error copying chunks from file_id {source_file_id} in Chroma: {str(e)}")
+        return None
+
 # def process_pdf(file_path: str) -> List[Dict]:
 #     """Process PDF file and extract text chunks with metadata."""
 #     try:
@@ -251,127 +558,213 @@ def delete_doc_from_chroma(file_id: int, user_id: int):
 
 
 
-def process_pdf(file_path: str) -> List[Dict]:
-    """Process a PDF file using OCR and return extracted text chunks with basic metadata."""
+def _section_bounds(count: int) -> List[tuple]:
+    """Split [0, count) into at most SUMMARY_SECTIONS contiguous (start, end) groups."""
+    sections = min(count, SUMMARY_SECTIONS)
+    if sections == 0:
+        return []
+    base, extra = divmod(count, sections)
+    bounds = []
+    start = 0
+    for i in range(sections):
+        end = start + base + (1 if i < extra else 0)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def build_layout_chunks(page_texts: List[str], page_blocks: List[List[Dict]], page_sizes: List[tuple]) -> List[Dict]:
+    """Group each page's text blocks, in reading order, into chunks with the union of their bounding boxes.
+
+    Chunks never span pages and hold about CHUNK_TOKENS tokens, counted once per block. Coordinates are top-left-origin PDF points, and width/height are the
+    page size, which is how react-pdf-highlighter expects scaled positions.
+    """
+    chunks = []
+    for page_index, blocks in enumerate(page_blocks):
+        width, height = page_sizes[page_index]
+        text = (page_texts[page_index] or "").strip()
+        if not blocks and text:
+            # No layout for this page (cache entries from before blocks were kept): the whole page is the box
+            blocks = [{"text": text, "x1": 0, "y1": 0, "x2": width, "y2": height}]
+
+        current = None
+        for block in blocks:
+            # Oversized blocks are split like any other text, each piece keeping the block's box
+            block_tokens = count_tokens(block["text"])
+            if block_tokens > CHUNK_TOKENS:
+                pieces = [(piece, count_tokens(piece)) for piece in text_splitter.split_text(block["text"])]
+            else:
+                pieces = [(block["text"], block_tokens)]
+            for piece, piece_tokens in pieces:
+                # The joining newline is counted as one token
+                if current is not None and current["token_count"] + piece_tokens + 1 > CHUNK_TOKENS:
+                    chunks.append(current)
+                    current = None
+                if current is None:
+                    current = {
+                        "chunk_text": piece,
+                        "token_count": piece_tokens,
+                        "page_number": page_index + 1,
+                        "x1": block["x1"], "y1": block["y1"], "x2": block["x2"], "y2": block["y2"],
+                        "width": width, "height": height,
+                    }
+                else:
+                    current["chunk_text"] += "\n" + piece
+                    current["token_count"] += piece_tokens + 1
+                    current["x1"] = min(current["x1"], block["x1"])
+                    current["y1"] = min(current["y1"], block["y1"])
+                    current["x2"] = max(current["x2"], block["x2"])
+                    current["y2"] = max(current["y2"], block["y2"])
+        if current is not None:
+            chunks.append(current)
+    return chunks
+
+
+def process_pdf(file_path: str, workspace_dir: str, progress_callback: Optional[Callable[[str, int, int], None]] = None,
+                checkpoint: Optional[DocumentCheckpoint] = None) -> Dict:
+    """Process a PDF file using OCR and return its extracted text chunks and aggregated summary.
+
+    Pages with a usable text layer are read directly; only the rest go through OCR.
+    Split page ranges are written under workspace_dir, which the caller owns and cleans up.
+    progress_callback, if given, is called as (stage, completed, total) as each unit of work finishes.
+    With a checkpoint, every OCR'd page and section summary is saved as it finishes and reused on the next attempt.
+    Returns {"chunks": [...], "summary": str, "section_summaries": [...], "total_pages": int, "native_pages": int, ...},
+    where chunks are layout chunks with page_number and bounding box (see build_layout_chunks)
+    and summary_keys are the checkpoint keys of the summaries this version uses.
+    """
+    def report(stage: str, completed: int, total: int):
+        if progress_callback is not None:
+            progress_callback(stage, completed, total)
+
     try:
         logging.info(f"Processing PDF with OCR: {file_path}")
         
         pdf_path = file_path
-        with open(pdf_path, "rb") as f:
-            reader = PyPDF2.PdfReader(f)
-            total_pages = len(reader.pages)
-        print("Total pages in PDF:", total_pages)
-        
-        # Define number of pages per chunk (for example, 600/10 = 60 pages each)
-        chunk_pages = total_pages // 10
 
-        # Create directory to store PDF chunks
-        if not os.path.exists("chunks"):
-            os.makedirs("chunks")
-        
-        
-        # Function to split PDF into a new file given a page range
-        def split_pdf(input_pdf, output_pdf, start, end):
-            with open(input_pdf, "rb") as f:
+        # Born-digital pages keep their text layer and blocks; a None text marks a page that needs OCR
+        page_layouts = classify_pages(pdf_path)
+        page_texts = [page["text"] for page in page_layouts]
+        page_blocks = [page["blocks"] for page in page_layouts]
+        total_pages = len(page_texts)
+        ocr_page_indices = [i for i, text in enumerate(page_texts) if text is None]
+        print(f"Total pages in PDF: {total_pages} ({total_pages - len(ocr_page_indices)} native text, {len(ocr_page_indices)} need OCR)")
+
+        # Pages OCR'd before (in this or any other document) come straight from the page cache
+        cache_keys = page_cache_keys(pdf_path, ocr_page_indices)
+        cached_pages = get_cached_pages(list(set(cache_keys.values())))
+        for page_index in ocr_page_indices:
+            cached = cached_pages.get(cache_keys[page_index])
+            if cached is not None:
+                page_texts[page_index] = cached["markdown"]
+                page_blocks[page_index] = cached["blocks"]
+        cache_hits = sum(1 for i in ocr_page_indices if page_texts[i] is not None)
+
+        # Then pages a previous attempt at this document finished before it failed. They are keyed by the page's
+        # content like the cache, so a revised file uploaded over a failed attempt never gets the old pages' text
+        if checkpoint is not None:
+            for page_index in ocr_page_indices:
+                if page_texts[page_index] is None:
+                    saved = checkpoint.load("ocr", cache_keys[page_index])
+                    if saved is not None:
+                        page_texts[page_index] = saved["markdown"]
+                        page_blocks[page_index] = saved["blocks"]
+        pages_to_ocr = [i for i in ocr_page_indices if page_texts[i] is None]
+        resumed_pages = len(ocr_page_indices) - cache_hits - len(pages_to_ocr)
+        logging.info(f"OCR cache served {cache_hits} and checkpoints {resumed_pages} of {len(ocr_page_indices)} pages")
+
+        range_files = []
+        range_pages = []
+        if pages_to_ocr:
+            # Parse the PDF once and cut every page range from the same reader
+            with open(pdf_path, "rb") as f:
                 reader = PyPDF2.PdfReader(f)
-                writer = PyPDF2.PdfWriter()
-                for i in range(start, end):
-                    writer.add_page(reader.pages[i])
-                with open(output_pdf, "wb") as f_out:
-                    writer.write(f_out)
-        
-        chunk_files = []
-        for i in range(10):
-            start_page = i * chunk_pages
-            # Ensure the last chunk takes any remainder pages
-            end_page = (i + 1) * chunk_pages if i < 9 else total_pages
-            chunk_filename = f"chunks/chunk_{i+1}.pdf"
-            split_pdf(pdf_path, chunk_filename, start_page, end_page)
-            chunk_files.append(chunk_filename)
-            print(f"Created {chunk_filename} (pages {start_page+1} to {end_page})")
-            
-        # Set up Docling OCR pipeline
-        pipeline_options = PdfPipelineOptions()
-        pipeline_options.do_ocr = True
-        pipeline_options.ocr_options = EasyOcrOptions()
-        pipeline_options.ocr_options.lang = ["en", "de", "es", "fr"]
-
-        converter = DocumentConverter(
-            format_options={
-                InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-            }
-        )
-        
-        
-        api_key = OPENAI_API_KEY  # Replace this with your fresh key
-
-        client = openai.OpenAI(api_key=api_key)
 
-        def openai_summarize(text):
-            prompt = (
-                "Please provide a detailed and comprehensive summary of the following text. "
-                "This should not be a brief or surface-level overview — I’m looking for a thorough, in-depth summary "
-                "that captures the key ideas, reasoning, and structure of the content. "
-                "The summary should be extensive — ideally at least half as long as the original — and should span multiple paragraphs (or even pages) if needed.\n\n"
-                "When you provide the summary, please output only the core content without any additional sections such as an introduction, conclusion, or any other extraneous blocks.\n\n"
-
-                f"{text}"
-            )
-
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.5
-            )
-            return response.choices[0].message.content
-
-        
-        
-
-        # Convert PDF and extract markdown
-        result = converter.convert(file_path)
-        markdown_text = result.document.export_to_markdown()
-        
-    
-        
-        summaries = []
-        for chunk_file in chunk_files:
-            print(f"Processing {chunk_file}...")
-            # Convert the chunk using the converter that was already initialized with pipeline_options
-            result = converter.convert(chunk_file)
-
-            # Export the processed document as markdown (or JSON if preferred)
-            chunk_text = result.document.export_to_markdown()
-
-            print(f"Extracted text from {chunk_file}. Generating summary...")
-            summary = openai_summarize(chunk_text)
-            summaries.append(summary)
-            print(f"Summary for {chunk_file}:\n{chunk_text}\n{'-'*40}")
+                # Size the page ranges to the OCR pool and the number of OCR pages instead of a fixed 10
+                page_ranges = plan_page_ranges(len(pages_to_ocr))
+
+                for i, (start, end) in enumerate(page_ranges):
+                    pages = pages_to_ocr[start:end]
+                    writer = PyPDF2.PdfWriter()
+                    for page_index in pages:
+                        writer.add_page(reader.pages[page_index])
+                    chunk_filename = os.path.join(workspace_dir, f"chunk_{i+1}.pdf")
+                    with open(chunk_filename, "wb") as f_out:
+                        writer.write(f_out)
+                    range_files.append((chunk_filename, len(pages)))
+                    range_pages.append(pages)
+                    print(f"Created {chunk_filename} ({len(pages)} pages from page {pages[0]+1} to {pages[-1]+1})")
+                    report("split", i + 1, len(page_ranges))
+
+        def save_range(index: int, results: List[Dict]):
+            # Persist each range as it lands, so a failure later on keeps the pages already done
+            pages = range_pages[index]
+            for page_index, page in zip(pages, results):
+                page_texts[page_index] = page["markdown"]
+                page_blocks[page_index] = page["blocks"]
+                if checkpoint is not None:
+                    checkpoint.save("ocr", cache_keys[page_index], page)
+            put_cached_pages({cache_keys[i]: page for i, page in zip(pages, results)})
+
+        # OCR the page ranges across the process pool and slot each page's markdown and blocks back in place.
+        # This is the only conversion pass: summaries and chunks are built from the pages.
+        report("ocr", 0, len(range_files))
+        convert_page_ranges(
+            range_files,
+            progress_callback=lambda completed, total: report("ocr", completed, total),
+            result_callback=save_range
+        )
 
+        # Group consecutive pages into at most SUMMARY_SECTIONS summary inputs
+        sections = [
+            "\n\n".join(page_texts[start:end])
+            for start, end in _section_bounds(total_pages)
+        ]
+
+        # Sections summarized by a previous attempt are reused; checkpoints are keyed by the section text
+        summaries = [None] * len(sections)
+        if checkpoint is not None:
+            summaries = [checkpoint.load("summaries", content_key(section)) for section in sections]
+        pending = [i for i, summary in enumerate(summaries) if summary is None]
+        resumed_summaries = len(sections) - len(pending)
+
+        def save_summary(index: int, summary: str):
+            section_index = pending[index]
+            summaries[section_index] = summary
+            if checkpoint is not None:
+                checkpoint.save("summaries", content_key(sections[section_index]), summary)
+
+        # Summaries run concurrently under the shared rate limiter and come back in section order
+        report("summarize", resumed_summaries, len(sections))
+        summarize_sections(
+            [sections[i] for i in pending],
+            progress_callback=lambda completed, total: report("summarize", resumed_summaries + completed, len(sections)),
+            result_callback=save_summary
+        )
 
-        
         final_summary = "\n\n".join(summaries)
-        summary_filename = "temp_final_summary.txt"
-        with open(summary_filename, "w", encoding="utf-8") as f:
-            f.write(final_summary)
-        logging.info(f"Final Aggregated Summary saved to: {summary_filename}")
-
-        # Basic chunking based on headers or page breaks
-        chunks = []
-        for i, section in enumerate(markdown_text.split("\n\n")):
-            cleaned_text = section.strip()
-            if cleaned_text:
-                chunks.append({
-                    "chunk_id": i + 1,
-                    "chunk_text": cleaned_text,
-                    "source_file": file_path
-                })
+        logging.info(f"Aggregated {len(summaries)} section summaries ({len(final_summary)} characters)")
+
+        # Chunk along the page layout so every chunk keeps the page and box it came from
+        chunks = build_layout_chunks(
+            page_texts,
+            page_blocks,
+            [(page["width"], page["height"]) for page in page_layouts]
+        )
+        report("chunk", 1, 1)
 
         logging.info(f"Extracted {len(chunks)} chunks from PDF: {file_path}")
-        return chunks
+        return {
+            "chunks": chunks,
+            "summary": final_summary,
+            "total_pages": total_pages,
+            "native_pages": total_pages - len(ocr_page_indices),
+            "ocr_pages": len(ocr_page_indices),
+            "ocr_cache_hits": cache_hits,
+            "resumed_pages": resumed_pages,
+            "resumed_summaries": resumed_summaries,
+            "section_summaries": summaries,
+            "summary_keys": [content_key(section) for section in sections]
+        }
 
     except Exception as e:
         logging.error(f"Error processing PDF: {str(e)}")
@@ -382,20 +775,25 @@ def process_pdf(file_path: str) -> List[Dict]:
     
 def clear_vectorstore():
     """Clear all data from the vector store."""
+    global _client
     try:
-        # Get vectorstore instance
-        vectorstore = get_vectorstore()
-        
-        # Delete all documents
-        vectorstore._collection.delete(where={})
-        
-        # Reset the singleton instance
-        global _vectorstore
-        _vectorstore = None
+        with _vectorstore_lock:
+            # Drop every user's collection, and the global one if it's still around
+            if _client is not None or CHROMA_HOST:
+                _client = _get_chroma_client()
+                for collection in _client.list_collections():
+                    _client.delete_collection(getattr(collection, "name", collection))
+
+            # Reset the shared instances
+            _client = None
+            _vectorstores.clear()
+        bump_corpus_version()
         
         # Delete the persistent storage
         if os.path.exists("./chroma_db"):
             shutil.rmtree("./chroma_db")
+        if os.path.exists(FAISS_DIR):
+            shutil.rmtree(FAISS_DIR)
             
         logging.info("Successfully cleared vector store")
         return True
@@ -0,0 +1,41 @@
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Explicit scratch root; when unset, the system temp dir (TMPDIR), which should be on disk
+INGEST_SCRATCH_DIR = os.getenv("INGEST_SCRATCH_DIR")
+# Opt in to scratch on tmpfs. Its pages count against the container's memory limit, so large uploads can OOM the worker
+INGEST_SCRATCH_TMPFS = os.getenv("INGEST_SCRATCH_TMPFS", "false").lower() in ("1", "true", "yes")
+# Free space tmpfs must have before ingestion scratch is put there, since it is backed by RAM
+INGEST_TMPFS_MIN_FREE_MB = int(os.getenv("INGEST_TMPFS_MIN_FREE_MB", "2048"))
+
+TMPFS_PATH = "/dev/shm"
+
+
+def _scratch_root() -> Optional[str]:
+    if INGEST_SCRATCH_DIR:
+        os.makedirs(INGEST_SCRATCH_DIR, exist_ok=True)
+        return INGEST_SCRATCH_DIR
+
+    if INGEST_SCRATCH_TMPFS and os.path.isdir(TMPFS_PATH) and os.access(TMPFS_PATH, os.W_OK):
+        free_mb = shutil.disk_usage(TMPFS_PATH).free // (1024 * 1024)
+        if free_mb >= INGEST_TMPFS_MIN_FREE_MB:
+            return TMPFS_PATH
+
+    # None makes tempfile fall back to TMPDIR / the system default
+    return None
+
+
+@contextmanager
+def ingestion_workspace(prefix: str = "ingest-") -> Iterator[str]:
+    """Private scratch directory for one ingestion, removed however the block exits."""
+    path = tempfile.mkdtemp(prefix=prefix, dir=_scratch_root())
+    logging.info(f"Created ingestion workspace {path}")
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+        logging.info(f"Removed ingestion workspace {path}")
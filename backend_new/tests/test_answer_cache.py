@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def answer_cache(tmp_path, monkeypatch):
+    # The app's database is rag_app.db in the working directory
+    monkeypatch.chdir(tmp_path)
+    from services import answer_cache, database
+    database.create_application_logs()
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_ENABLED", True)
+    return answer_cache
+
+
+def test_only_the_first_question_of_a_chat_uses_the_cache(answer_cache):
+    from services.database import create_or_get_chat, store_chat_message
+
+    create_or_get_chat("chat-1", user_id=1, model="gpt-4o-mini")
+    assert answer_cache.answer_cache_applies("chat-1")
+
+    store_chat_message("chat-1", "What does the contract cover?", "Deliveries and returns.")
+
+    assert not answer_cache.answer_cache_applies("chat-1")
+    # Other chats are unaffected
+    assert answer_cache.answer_cache_applies("chat-2")
+
+
+def test_disabled_cache_never_applies(answer_cache, monkeypatch):
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_ENABLED", False)
+
+    assert not answer_cache.answer_cache_applies("chat-1")
@@ -0,0 +1,94 @@
+import types
+
+import pytest
+
+openai = pytest.importorskip("openai")
+pytest.importorskip("langchain_openai")
+pytest.importorskip("langchain_ollama")
+pytest.importorskip("tiktoken")
+pytest.importorskip("dotenv")
+
+from langchain_core.embeddings import Embeddings
+
+from services import embeddings
+from services.embeddings import RetryingEmbeddings, embed_batches
+
+
+def _status_error(error_type, status_code):
+    response = types.SimpleNamespace(status_code=status_code, headers={}, request=None)
+    return error_type(f"HTTP {status_code}", response=response, body=None)
+
+
+class OllamaError(Exception):
+    """How Ollama reports HTTP errors: any exception type, with the status attached."""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FlakyEmbeddings(Embeddings):
+    """Fails the first call for each text with the given errors, then embeds it as [len(text)]."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    def _call(self, texts):
+        self.calls.append(list(texts))
+        if self.errors:
+            raise self.errors.pop(0)
+        return [[float(len(text))] for text in texts]
+
+    def embed_documents(self, texts):
+        return self._call(texts)
+
+    def embed_query(self, text):
+        return self._call([text])[0]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(embeddings, "retry_delay", lambda error, attempt: 0.0)
+    monkeypatch.setattr(embeddings, "EMBED_MAX_RETRIES", 3)
+
+
+@pytest.mark.parametrize("error", [
+    _status_error(openai.InternalServerError, 500),
+    _status_error(openai.InternalServerError, 503),
+    OllamaError(502),
+    _status_error(openai.RateLimitError, 429),
+])
+def test_embed_batches_retries_server_errors_then_succeeds(error):
+    model = FlakyEmbeddings(error)
+    results = {}
+
+    embed_batches(model, [["a", "bb"]], lambda index, vectors: results.setdefault(index, vectors), concurrency=1)
+
+    assert results == {0: [[1.0], [2.0]]}
+    assert model.calls == [["a", "bb"], ["a", "bb"]]
+
+
+def test_embed_batches_gives_up_after_max_retries():
+    error = _status_error(openai.InternalServerError, 500)
+    model = FlakyEmbeddings(*[error] * 4)
+
+    with pytest.raises(openai.InternalServerError):
+        embed_batches(model, [["a"]], lambda index, vectors: None, concurrency=1)
+    assert len(model.calls) == 4
+
+
+@pytest.mark.parametrize("error", [_status_error(openai.BadRequestError, 400), OllamaError(404), ValueError("bad input")])
+def test_embed_batches_does_not_retry_other_errors(error):
+    model = FlakyEmbeddings(error)
+
+    with pytest.raises(type(error)):
+        embed_batches(model, [["a"]], lambda index, vectors: None, concurrency=1)
+    assert len(model.calls) == 1
+
+
+def test_query_embeddings_are_retried():
+    model = FlakyEmbeddings(_status_error(openai.InternalServerError, 500))
+
+    assert RetryingEmbeddings(model).embed_query("abc") == [3.0]
+    assert len(model.calls) == 2
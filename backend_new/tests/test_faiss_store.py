@@ -0,0 +1,163 @@
+import shutil
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+from services import faiss_store
+from services.faiss_store import FaissCollection
+
+DIMENSIONS = 16
+
+
+@pytest.fixture(params=["flat", "hnsw", "ivf"])
+def index_type(request, monkeypatch):
+    monkeypatch.setattr(faiss_store, "FAISS_INDEX_TYPE", request.param)
+    # Small enough for the test collections to train IVF clusters, searched exhaustively
+    monkeypatch.setattr(faiss_store, "FAISS_IVF_MIN_TRAIN", 64)
+    monkeypatch.setattr(faiss_store, "FAISS_IVF_NLIST", 4)
+    monkeypatch.setattr(faiss_store, "FAISS_IVF_NPROBE", 4)
+    # Compaction only when a test asks for it
+    monkeypatch.setattr(faiss_store, "FAISS_MAX_SEGMENTS", 1000)
+    monkeypatch.setattr(faiss_store, "FAISS_COMPACT_RATIO", 1.0)
+    return request.param
+
+
+def _vectors(count, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, DIMENSIONS)).astype(np.float32)
+
+
+def _add(collection, vectors, file_id, start=0):
+    ids = [f"{file_id}-{start + i}" for i in range(len(vectors))]
+    collection.upsert(
+        ids=ids,
+        embeddings=vectors.tolist(),
+        documents=[f"text of {vector_id}" for vector_id in ids],
+        metadatas=[{"file_id": file_id, "user_id": 1, "chunk": start + i} for i in range(len(vectors))],
+    )
+    return ids
+
+
+def _segments(collection):
+    conn = collection._connect()
+    count = conn.execute('SELECT COUNT(*) FROM segments').fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_query_finds_added_vectors(tmp_path, index_type):
+    collection = FaissCollection("docs", str(tmp_path))
+    vectors = _vectors(100)
+    ids = _add(collection, vectors, file_id=1)
+
+    result = collection.query([vectors[7].tolist()], n_results=3, include=("documents", "metadatas", "distances"))
+
+    assert result["ids"][0][0] == ids[7]
+    assert result["documents"][0][0] == f"text of {ids[7]}"
+    assert result["metadatas"][0][0]["chunk"] == 7
+    assert result["distances"][0][0] == pytest.approx(0.0, abs=1e-5)
+    assert len(result["ids"][0]) == 3
+    assert collection.count() == 100
+
+
+def test_reopened_collection_serves_the_same_vectors(tmp_path, index_type):
+    collection = FaissCollection("docs", str(tmp_path))
+    vectors = _vectors(100)
+    ids = _add(collection, vectors[:50], file_id=1)
+    ids += _add(collection, vectors[50:], file_id=1, start=50)
+    collection.modify({"embedding_model": "test-model"})
+    collection.flush()
+
+    reopened = FaissCollection("docs", str(tmp_path))
+
+    assert reopened.metadata == {"embedding_model": "test-model"}
+    assert reopened.count() == 100
+    result = reopened.query([vectors[60].tolist()], n_results=1)
+    assert result["ids"] == [[ids[60]]]
+    stored = reopened.get(ids=[ids[3]], include=("embeddings",))["embeddings"][0]
+    assert np.allclose(stored, faiss_store._normalized(vectors[3])[0], atol=1e-5)
+
+
+def test_upsert_replaces_the_earlier_copy(tmp_path, index_type):
+    collection = FaissCollection("docs", str(tmp_path))
+    vectors = _vectors(100)
+    ids = _add(collection, vectors, file_id=1)
+    collection.flush()
+
+    moved = _vectors(1, seed=1)
+    collection.upsert(ids=[ids[0]], embeddings=moved.tolist(), documents=["new text"], metadatas=[{"file_id": 1}])
+
+    assert collection.query([moved[0].tolist()], n_results=1, include=("documents",))["documents"] == [["new text"]]
+    # The old copy is still on disk but never returned
+    old = collection.query([vectors[0].tolist()], n_results=100)["ids"][0]
+    assert old.count(ids[0]) == 1
+    assert collection.count() == 100
+
+
+def test_deleted_vectors_are_not_returned(tmp_path, index_type):
+    collection = FaissCollection("docs", str(tmp_path))
+    vectors = _vectors(100)
+    kept = _add(collection, vectors[:50], file_id=1)
+    deleted = _add(collection, vectors[50:], file_id=2, start=50)
+
+    collection.delete(where={"file_id": 2})
+
+    result = collection.query([vectors[75].tolist()], n_results=10)
+    assert len(result["ids"][0]) == 10
+    assert not set(result["ids"][0]) & set(deleted)
+    assert collection.get(where={"file_id": 2})["ids"] == []
+    assert set(collection.get()["ids"]) == set(kept)
+
+
+def test_query_fills_n_results_past_many_deleted_neighbours(tmp_path, index_type):
+    collection = FaissCollection("docs", str(tmp_path))
+    # Near copies of one vector, so every deleted one outranks every kept one
+    base = _vectors(1)
+    near = base + 0.01 * _vectors(80, seed=2)
+    far = _vectors(20, seed=3)
+    deleted = _add(collection, near, file_id=1)
+    kept = _add(collection, far, file_id=2)
+
+    collection.delete(ids=deleted)
+
+    result = collection.query([base[0].tolist()], n_results=10)
+    assert len(result["ids"][0]) == 10
+    assert set(result["ids"][0]) <= set(kept)
+
+
+def test_compaction_merges_segments_and_drops_dead_vectors(tmp_path, index_type):
+    collection = FaissCollection("docs", str(tmp_path))
+    vectors = _vectors(120)
+    ids = []
+    for start in range(0, 120, 30):
+        ids += _add(collection, vectors[start:start + 30], file_id=start // 30, start=start)
+        collection.flush()
+    collection.delete(where={"file_id": 0})
+    assert _segments(collection) == 4
+
+    collection.compact()
+
+    assert _segments(collection) == 1
+    assert len([name for name in (tmp_path / "docs").iterdir() if name.suffix == ".faiss"]) == 1
+    reopened = FaissCollection("docs", str(tmp_path))
+    assert reopened.count() == 90
+    assert reopened.query([vectors[100].tolist()], n_results=1)["ids"] == [[ids[100]]]
+    assert reopened.query([vectors[10].tolist()], n_results=90)["ids"][0].count(ids[10]) == 0
+
+
+def test_open_collection_starts_again_after_its_directory_is_removed(tmp_path, index_type):
+    collection = FaissCollection("docs", str(tmp_path))
+    old = _add(collection, _vectors(50), file_id=1)
+    collection.flush()
+    assert collection.query([_vectors(50)[0].tolist()], n_results=1)["ids"] == [[old[0]]]
+
+    # What clearing the vector store does while other handles stay open
+    shutil.rmtree(tmp_path / "docs")
+
+    assert collection.count() == 0
+    new_vectors = _vectors(50, seed=5)
+    new = _add(collection, new_vectors, file_id=2)
+    result = collection.query([new_vectors[0].tolist()], n_results=50)
+    assert result["ids"][0][0] == new[0]
+    assert set(result["ids"][0]) == set(new)
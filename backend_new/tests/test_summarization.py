@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("tiktoken")
+pytest.importorskip("dotenv")
+
+from services import summarization
+from services.summarization import RateLimiter, summarize_sections
+
+# Prompt tokens the fake encoding counts for every section
+PROMPT_TOKENS = 10
+
+
+class FakeEncoding:
+    def encode(self, text):
+        return [0] * PROMPT_TOKENS
+
+
+class StubChatCompletions:
+    """A local chat-completions endpoint that summarizes each section as "summary of <section>".
+
+    rate_limited maps a section to how many of its requests get a 429 with retry_after seconds in Retry-After.
+    Later sections are answered faster, so responses come back out of input order.
+    """
+
+    def __init__(self, rate_limited=None, retry_after=0.3):
+        self.rate_limited = dict(rate_limited or {})
+        self.retry_after = retry_after
+        # (time received, time answered, section, status) per request
+        self.requests = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received = time.monotonic()
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                section = body["messages"][-1]["content"].rsplit("\n", 1)[-1]
+                with stub.lock:
+                    limited = stub.rate_limited.get(section, 0) > 0
+                    if limited:
+                        stub.rate_limited[section] -= 1
+
+                if limited:
+                    status, headers = 429, {"Retry-After": str(stub.retry_after)}
+                    payload = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+                else:
+                    time.sleep(0.02 * (9 - int(section.split()[-1])))
+                    status, headers = 200, {}
+                    payload = {
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion",
+                        "created": 0,
+                        "model": body["model"],
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": f"summary of {section}"},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": {"prompt_tokens": PROMPT_TOKENS, "completion_tokens": 5, "total_tokens": PROMPT_TOKENS + 5},
+                    }
+
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                with stub.lock:
+                    stub.requests.append((received, time.monotonic(), section, status))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def received(self, section=None):
+        return sorted(received for received, _, name, _ in self.requests if section in (None, name))
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    def start(**kwargs):
+        stub = StubChatCompletions(**kwargs)
+        stub.thread.start()
+        stubs.append(stub)
+        monkeypatch.setenv("OPENAI_BASE_URL", stub.base_url)
+        return stub
+
+    stubs = []
+    monkeypatch.setattr(summarization, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(summarization, "_get_encoding", lambda: FakeEncoding())
+    monkeypatch.setattr(summarization, "_rate_limiter", RateLimiter(10000, 10000000))
+    yield start
+    for stub in stubs:
+        stub.server.shutdown()
+        stub.server.server_close()
+
+
+def _sections(count):
+    return [f"section {i}" for i in range(count)]
+
+
+def test_summaries_come_back_in_input_order_after_429s(endpoint):
+    stub = endpoint(rate_limited={"section 1": 1, "section 4": 2}, retry_after=0.3)
+    ready = {}
+
+    summaries = summarize_sections(_sections(8), result_callback=lambda index, summary: ready.setdefault(index, summary))
+
+    assert summaries == [f"summary of section {i}" for i in range(8)]
+    assert ready == dict(enumerate(summaries))
+    # Each summary was answered exactly once, after the 429s were retried
+    answered = [section for _, _, section, status in stub.requests if status == 200]
+    assert sorted(answered) == sorted(_sections(8))
+    assert len(stub.received("section 4")) == 3
+    # Completion order differed from input order, so the order above isn't an accident
+    assert answered != _sections(8)
+
+
+def test_429_holds_requests_for_retry_after(endpoint):
+    stub = endpoint(rate_limited={"section 0": 1}, retry_after=0.5)
+
+    summarize_sections(_sections(1))
+
+    (_, rejected_at, _, status), = [request for request in stub.requests if request[3] == 429]
+    retried_at = stub.received("section 0")[-1]
+    assert status == 429
+    assert retried_at - rejected_at >= 0.5 * 0.9
+
+
+def test_requests_are_paced_by_the_rpm_bucket(endpoint, monkeypatch):
+    stub = endpoint()
+    # 10 requests a second, starting from an empty bucket so none go out in a burst
+    limiter = RateLimiter(600, 10000000)
+    limiter.requests.drain(0)
+    monkeypatch.setattr(summarization, "_rate_limiter", limiter)
+
+    summarize_sections(_sections(6))
+
+    received = stub.received()
+    for earlier, later in zip(received, received[1:]):
+        assert later - earlier >= 0.1 * 0.8
+    assert received[-1] - received[0] >= 0.5 * 0.9
+
+
+def test_requests_are_paced_by_the_tpm_bucket(endpoint, monkeypatch):
+    stub = endpoint()
+    # 100 tokens a second; each request reserves its prompt plus the completion budget, 15 tokens
+    limiter = RateLimiter(10000, 6000)
+    limiter.tokens.drain(0)
+    monkeypatch.setattr(summarization, "_rate_limiter", limiter)
+    budget = int(PROMPT_TOKENS * (1 + summarization.SUMMARY_COMPLETION_RATIO))
+
+    summarize_sections(_sections(5))
+
+    received = stub.received()
+    assert len(received) == 5
+    assert received[-1] - received[0] >= 4 * budget / 100 * 0.9
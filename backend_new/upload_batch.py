@@ -0,0 +1,111 @@
+"""Bulk-upload PDFs to the backend through /upload-batch.
+
+    python upload_batch.py --email me@example.com --password ... reports/ archive.zip extra.pdf --wait
+
+Directories are searched recursively for PDFs; zip archives are sent as-is and unpacked by the server.
+"""
+import argparse
+import getpass
+import os
+import sys
+import time
+from contextlib import ExitStack
+
+import requests
+
+TERMINAL_STATUSES = {"completed", "failed", "duplicate", "rejected"}
+
+
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(
+                    os.path.join(root, name) for name in sorted(names)
+                    if name.lower().endswith((".pdf", ".zip"))
+                )
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"Skipping {path}: not found", file=sys.stderr)
+    return files
+
+
+def login(url, email, password):
+    response = requests.post(f"{url}/login", json={"email": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def upload_group(url, headers, paths):
+    with ExitStack() as stack:
+        files = [
+            ("files", (os.path.basename(path), stack.enter_context(open(path, "rb"))))
+            for path in paths
+        ]
+        response = requests.post(f"{url}/upload-batch", headers=headers, files=files)
+    response.raise_for_status()
+    return response.json()
+
+
+def print_manifest(manifest):
+    for file in manifest["files"]:
+        detail = file.get("error") or (f"{file['stage']} {file['progress']:.0f}%" if file.get("stage") else "")
+        print(f"  {file['status']:<10} {file['filename']}  {detail}")
+    print(f"  {manifest['counts']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload many PDFs (or zip archives of PDFs) for ingestion.")
+    parser.add_argument("paths", nargs="+", help="PDF files, zip archives or directories")
+    parser.add_argument("--url", default=os.getenv("RAG_API_URL", "http://localhost:8000"))
+    parser.add_argument("--token", default=os.getenv("RAG_API_TOKEN"), help="bearer token (or use --email)")
+    parser.add_argument("--email", help="log in with this account instead of passing a token")
+    parser.add_argument("--password", help="password for --email (prompted for if omitted)")
+    parser.add_argument("--files-per-request", type=int, default=25,
+                        help="files sent per /upload-batch request, to keep request bodies bounded")
+    parser.add_argument("--wait", action="store_true", help="poll until every file has finished ingesting")
+    parser.add_argument("--poll-interval", type=float, default=10.0)
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/")
+    token = args.token
+    if args.email:
+        token = login(url, args.email, args.password or getpass.getpass())
+    if not token:
+        parser.error("pass --token, set RAG_API_TOKEN or log in with --email")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    paths = collect_files(args.paths)
+    if not paths:
+        parser.error("no PDF or zip files found")
+
+    batch_ids = []
+    for start in range(0, len(paths), args.files_per_request):
+        group = paths[start:start + args.files_per_request]
+        manifest = upload_group(url, headers, group)
+        batch_ids.append(manifest["batch_id"])
+        print(f"Batch {manifest['batch_id']}: uploaded {start + len(group)} of {len(paths)} files")
+        print_manifest(manifest)
+
+    if not args.wait:
+        return
+
+    pending = list(batch_ids)
+    while pending:
+        time.sleep(args.poll_interval)
+        for batch_id in list(pending):
+            response = requests.get(f"{url}/batches/{batch_id}", headers=headers)
+            response.raise_for_status()
+            manifest = response.json()
+            if all(file["status"] in TERMINAL_STATUSES for file in manifest["files"]):
+                print(f"Batch {batch_id} finished")
+                print_manifest(manifest)
+                pending.remove(batch_id)
+            else:
+                print(f"Batch {batch_id}: {manifest['counts']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 import { useState, useEffect } from 'react';
 import { LoadingSpinner } from '../common/LoadingStates';
 import { uploadDocument } from '../../services/document.service';
+import ProcessingStatus from './ProcessingStatus';
 
 export default function DocumentUpload({setReload, reload}) {
   const [isDragging, setIsDragging] = useState(false);
   const [isUploading, setIsUploading] = useState(false);
   const [loadingMessage, setLoadingMessage] = useState(0);
+  const [jobs, setJobs] = useState([]);
 
   const loadingMessages = [
     "Uploading your document...",
@@ -56,7 +58,10 @@ export default function DocumentUpload({setReload, reload}) {
         const user = localStorage.getItem('user');
         const userp = JSON.parse(user);
         const userId = userp.user_id;
-        await uploadDocument(file, userId);
+        const data = await uploadDocument(file, userId);
+        if (data?.job_id && data.status === 'queued') {
+          setJobs((prev) => [...prev, { job_id: data.job_id, filename: file.name }]);
+        }
       }
       setReload(!reload);
     } catch (error) {
@@ -67,8 +72,14 @@ export default function DocumentUpload({setReload, reload}) {
     }
   };
 
+  const handleJobFinished = (jobId, outcome) => {
+    setJobs((prev) => prev.filter((job) => job.job_id !== jobId));
+    if (outcome === 'completed') setReload((prev) => !prev);
+  };
+
   return (
     <div className="p-4 border-b border-gray-700 bg-[#1C1E21]">
+      <ProcessingStatus jobs={jobs} onFinished={handleJobFinished} />
       <div
         onDragOver={handleDragOver}
         onDragLeave={handleDragLeave}
@@ -109,4 +120,4 @@ export default function DocumentUpload({setReload, reload}) {
       </div>
     </div>
   );
-} 
\ No newline at end of file
+}
\ No newline at end of file
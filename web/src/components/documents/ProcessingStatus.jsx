@@ -1,44 +1,74 @@
 import { useState, useEffect } from 'react';
-import { useApp } from '../../hooks/useApp';
+import { watchIngestionJob } from '../../services/document.service';
 
-export default function ProcessingStatus() {
-  const { documents } = useApp();
-  const [processingDocs, setProcessingDocs] = useState([]);
+const stageLabels = {
+  split: 'Splitting pages',
+  ocr: 'Running OCR',
+  summarize: 'Summarizing',
+  chunk: 'Chunking',
+  index: 'Embedding and indexing',
+};
+
+function JobStatus({ job, onFinished }) {
+  const [status, setStatus] = useState({ stage: 'queued', progress: 0 });
 
   useEffect(() => {
-    // In a real app, this would connect to your backend to get processing status
-    const processingStatus = documents.filter(doc => doc.status === 'processing');
-    setProcessingDocs(processingStatus);
-  }, [documents]);
+    const controller = new AbortController();
+
+    watchIngestionJob(job.job_id, (event, data) => {
+      if (event === 'completed' || event === 'failed') {
+        setStatus({ stage: event, progress: data.progress, error: data.error });
+        onFinished?.(job.job_id, event);
+      } else if (event === 'stage_started' || event === 'progress') {
+        setStatus({
+          stage: data.stage,
+          progress: data.progress,
+          completed: data.completed,
+          total: data.total,
+          elapsed: data.elapsed,
+        });
+      }
+    }, controller.signal).catch((error) => {
+      if (error.name !== 'AbortError') console.error('Job status error:', error);
+    });
+
+    return () => controller.abort();
+  }, [job.job_id]);
 
-  if (processingDocs.length === 0) return null;
+  const label = stageLabels[status.stage] || status.stage;
 
   return (
-    <div className="p-4 bg-yellow-50 border-b">
-      <div className="flex items-center">
-        <svg
-          className="animate-spin -ml-1 mr-3 h-5 w-5 text-yellow-700"
-          fill="none"
-          viewBox="0 0 24 24"
-        >
-          <circle
-            className="opacity-25"
-            cx="12"
-            cy="12"
-            r="10"
-            stroke="currentColor"
-            strokeWidth="4"
-          />
-          <path
-            className="opacity-75"
-            fill="currentColor"
-            d="M4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"
-          />
-        </svg>
-        <span className="text-sm text-yellow-700">
-          Processing {processingDocs.length} document(s)...
+    <div className="space-y-1">
+      <div className="flex justify-between text-sm text-yellow-700">
+        <span className="truncate">{job.filename}</span>
+        <span>
+          {label}
+          {status.total > 1 && ` ${status.completed}/${status.total}`}
+          {status.elapsed != null && ` · ${Math.round(status.elapsed)}s`}
         </span>
       </div>
+      {status.error ? (
+        <div className="text-xs text-red-600">{status.error}</div>
+      ) : (
+        <div className="h-1.5 bg-yellow-100 rounded">
+          <div
+            className="h-1.5 bg-yellow-500 rounded transition-all"
+            style={{ width: `${status.progress || 0}%` }}
+          />
+        </div>
+      )}
+    </div>
+  );
+}
+
+export default function ProcessingStatus({ jobs = [], onFinished }) {
+  if (jobs.length === 0) return null;
+
+  return (
+    <div className="p-4 mb-4 bg-yellow-50 rounded space-y-3">
+      {jobs.map((job) => (
+        <JobStatus key={job.job_id} job={job} onFinished={onFinished} />
+      ))}
     </div>
   );
-} 
\ No newline at end of file
+}
@@ -32,6 +32,45 @@ export const uploadDocument = async (file, userId) => {
   }
 };
 
+// Streams an ingestion job's progress events. fetch rather than EventSource, which can't send the bearer token.
+export const watchIngestionJob = async (jobId, onEvent, signal) => {
+  const user = localStorage.getItem("user");
+  const userp = JSON.parse(user);
+  const token = userp.access_token;
+
+  const response = await fetch(`${API_URL}/jobs/${jobId}/events`, {
+    headers: {
+      Accept: "text/event-stream",
+      Authorization: `Bearer ${token}`,
+    },
+    signal,
+  });
+  if (!response.ok) {
+    throw new Error(`Failed to watch ingestion job ${jobId}`);
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += value;
+
+    // Events are separated by a blank line; keep any partial event for the next read
+    const messages = buffer.split("\n\n");
+    buffer = messages.pop();
+    for (const message of messages) {
+      let event = "message";
+      let data = "";
+      for (const line of message.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+};
+
 export const listDocuments = async (userId) => {
   const user = localStorage.getItem("user");
   const userp = JSON.parse(user);